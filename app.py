@@ -1,152 +1,212 @@
 import streamlit as st
-import numpy as np
-from tensorflow.keras.models import load_model
-from PIL import Image
 import os
-import gdown
 import time
-from fpdf import FPDF
-from datetime import datetime
 import base64
+import io
+import tempfile
+import threading
+import numpy as np
+from datetime import datetime
+from prescription import create_prescription
+from bulk_prescriptions import iter_records, generate_zip, detect_format, text_stream
+from prediction_cache import PredictionCache, image_digest, file_checksum
+from model_preloader import ModelPreloader
+from model_registry import ModelRegistry
+from model_store import ensure_models
+from metrics import metrics
+from inference_service import INFERENCE_URL, InferenceClient
+from inference import (
+    JPEG_DRAFT, model_ids, model_input_size, decode_grayscale,
+    preprocess_image_tf, preprocess_batch_tf, predict_batch, interpret_prediction, start_tensorflow
+)
+from tflite_backend import BACKENDS, load_model_for_backend, artifact_path_for, configured_backends
+from gradcam import OVERLAY_WIDTH, gradcam, overlay_heatmap
+from tiling import tiled_predict
+from medical_images import DICOM_EXTENSIONS, is_dicom, frame_count
+from quality_gate import ENABLED as QUALITY_GATE, assess_quality
+from phash_index import PerceptualIndex, perceptual_hashes
+from history_store import HistoryStore
+from cpu_tuning import tuned_batch_size
+from previews import PREVIEW_WIDTH, PreviewCache, make_thumbnail, zoom_view
+from tta import tta_predict
+from ensemble import COMBINE_METHODS, combine, run_ensemble
+from cascade import FAST_MODEL, ESCALATION_MODELS, DEFAULT_BAND, THRESHOLD, needs_escalation
+
+# Prediction cache settings (set BONESCAN_CACHE_DISK_MB=0 to keep the cache in memory only)
+CACHE_DIR = os.environ.get("BONESCAN_CACHE_DIR", "models/prediction_cache")
+CACHE_DISK_MB = int(os.environ.get("BONESCAN_CACHE_DISK_MB", "64"))
+CACHE_MEMORY_ENTRIES = int(os.environ.get("BONESCAN_CACHE_MEMORY_ENTRIES", "1024"))
+
+# Default inference backend per model (see tflite_backend.configured_backends)
+MODEL_BACKENDS = configured_backends()
+
+# Models loaded and warmed in the background once detection is first opened (comma-separated names, empty to disable)
+PRELOAD_MODELS = [
+    (name.strip(), MODEL_BACKENDS.get(name.strip(), "keras"))
+    for name in os.environ.get("BONESCAN_PRELOAD_MODELS", ",".join(model_ids)).split(",")
+    if name.strip() in model_ids
+]
+
+# Show the latency metrics panel in the sidebar (collection itself is enabled by BONESCAN_METRICS=1)
+ADMIN_PANEL = os.environ.get("BONESCAN_ADMIN", "0") == "1"
+
+# Analysis mode that scores overlapping full-resolution tiles (see tiling.py)
+TILED = "Tiled High-Res"
+
+# Partial reruns for the detection workspace (st.experimental_fragment before Streamlit 1.37)
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
+
+# Sidebar options that combine several models
+ENSEMBLE = "Ensemble"
+CASCADE = "Cascade"
+
+# Perceptual-hash index of analysed films for near-duplicate reuse (empty to disable)
+PHASH_INDEX_PATH = os.environ.get("BONESCAN_PHASH_INDEX", "models/phash_index.jsonl")
+# Choices offered for a reused near-duplicate result
+ACCEPT_REUSED = "Accept the earlier result for this film"
+REANALYZE = "Re-analyze this film"
 
-# Model mappings for fracture detection
-model_ids = {
-     "DenseNet169 (Keras)": "1dIhc-0vd9sDoU5O6H0ZE6RYrP-CAyWks",
-    "InceptionV3 (Keras)": "1ARBL_SK66Ppj7_kJ1Pe2FhH2olbTQHWY",
-    "MobileNet (Keras)": "14YuV3qZb_6FI7pXoiJx69HxiDD4uNc_Q",
-    "EfficientNetB3 (Keras)": "1cQA3_oH2XjDFK-ZE9D9YsP6Ya8fQiPOy"
-}
+# Largest bulk prescription archive offered as a browser download. Streamlit holds a download
+# in memory, so larger archives stay on the server's disk instead
+BULK_DOWNLOAD_MB = int(os.environ.get("BONESCAN_BULK_DOWNLOAD_MB", "200"))
 
-# Function to download and load fracture detection model
+# SQLite audit history of analyses and prescriptions
+HISTORY_DB = os.environ.get("BONESCAN_HISTORY_DB", "models/history.db")
+
+# Memory for encoded image previews shared by all sessions
+PREVIEW_CACHE_MB = int(os.environ.get("BONESCAN_PREVIEW_CACHE_MB", "64"))
+
+# Memory budget for resident models; least-recently-used idle models are evicted beyond it
+MODEL_MEMORY_BUDGET_MB = int(os.environ.get("BONESCAN_MODEL_MEMORY_MB", "1536"))
+
+# Model registry shared by all sessions; replaces an unbounded per-model resource cache
 @st.cache_resource
-def load_tensorflow_model(file_id, model_name):
-    model_path = f"models/{model_name}.keras"
-    if not os.path.exists("models"):
-        os.makedirs("models")
-    if not os.path.exists(model_path):
-        gdown.download(f"https://drive.google.com/uc?id={file_id}", model_path, quiet=False)
-    return load_model(model_path)
-
-# Preprocessing function for fracture detection
-def preprocess_image_tf(uploaded_image, model):
-    input_shape = model.input_shape[1:3]
-    img = uploaded_image.resize(input_shape).convert("L")
-    img_array = np.array(img) / 255.0
-    img_array = np.stack([img_array] * 3, axis=-1)
-    img_array = np.expand_dims(img_array, axis=0)
-    return img_array
-
-# PDF Prescription Generator Class
-class PDF(FPDF):
-    def header(self):
-        self.set_font('Arial', 'B', 16)
-        self.cell(0, 10, 'MEDICAL PRESCRIPTION', 0, 1, 'C')
-        self.line(10, 20, 200, 20)
-        self.ln(10)
-        
-    def footer(self):
-        self.set_y(-15)
-        self.set_font('Arial', 'I', 8)
-        self.cell(0, 10, f'Page {self.page_no()}', 0, 0, 'C')
-
-def create_prescription(patient_info, diagnosis, medications, instructions, doctor_info):
-    pdf = PDF(orientation='P', unit='mm', format='A4')
-    pdf.add_page()
-    pdf.set_auto_page_break(auto=True, margin=15)
-    
-    # Header with clinic info
-    pdf.set_font('Arial', 'B', 12)
-    pdf.cell(0, 5, "BoneScan AI Medical Center", 0, 1, 'C')
-    pdf.set_font('Arial', '', 10)
-    pdf.cell(0, 5, "123 Medical Drive, Healthcare City", 0, 1, 'C')
-    pdf.cell(0, 5, "Phone: (123) 456-7890 | License: MED123456", 0, 1, 'C')
-    pdf.ln(10)
-    
-    # Date and prescription ID
-    pdf.set_font('Arial', '', 10)
-    pdf.cell(0, 5, f"Date: {datetime.now().strftime('%d-%m-%Y %H:%M:%S')}", 0, 1, 'R')
-    pdf.cell(0, 5, f"Prescription ID: RX-{datetime.now().strftime('%Y%m%d%H%M')}", 0, 1, 'R')
-    pdf.ln(5)
-    
-    # Patient information box
-    pdf.set_fill_color(240, 240, 240)
-    pdf.rect(10, 45, 190, 30, 'F')
-    pdf.set_font('Arial', 'B', 12)
-    pdf.set_xy(15, 50)
-    pdf.cell(0, 5, "PATIENT INFORMATION", 0, 1)
-    pdf.set_font('Arial', '', 10)
-    pdf.set_xy(15, 57)
-    pdf.cell(40, 5, f"Name: {patient_info['name']}", 0, 0)
-    pdf.cell(40, 5, f"Age: {patient_info['age']}", 0, 0)
-    pdf.cell(40, 5, f"Gender: {patient_info['gender']}", 0, 1)
-    pdf.set_xy(15, 64)
-    pdf.cell(40, 5, f"Patient ID: {patient_info['id']}", 0, 0)
-    pdf.cell(40, 5, f"Allergies: {patient_info['allergies']}", 0, 1)
-    pdf.ln(10)
-    
-    # Diagnosis
-    pdf.set_font('Arial', 'B', 12)
-    pdf.cell(0, 10, "DIAGNOSIS", 0, 1)
-    pdf.set_font('Arial', '', 11)
-    pdf.multi_cell(0, 7, diagnosis)
-    pdf.ln(10)
-    
-    # Medications
-    pdf.set_font('Arial', 'B', 12)
-    pdf.cell(0, 10, "PRESCRIBED MEDICATIONS", 0, 1)
-    pdf.set_font('Arial', '', 11)
-    
-    # Table header
-    pdf.set_fill_color(200, 200, 200)
-    pdf.cell(60, 8, "Medication", 1, 0, 'C', 1)
-    pdf.cell(30, 8, "Dosage", 1, 0, 'C', 1)
-    pdf.cell(30, 8, "Frequency", 1, 0, 'C', 1)
-    pdf.cell(30, 8, "Duration", 1, 0, 'C', 1)
-    pdf.cell(40, 8, "Instructions", 1, 1, 'C', 1)
-    
-    # Medication rows
-    pdf.set_fill_color(255, 255, 255)
-    for med in medications:
-        pdf.cell(60, 8, med['name'], 1)
-        pdf.cell(30, 8, med['dosage'], 1)
-        pdf.cell(30, 8, med['frequency'], 1)
-        pdf.cell(30, 8, med['duration'], 1)
-        pdf.cell(40, 8, med['special_instructions'], 1, 1)
-    pdf.ln(10)
-    
-    # Additional Instructions
-    pdf.set_font('Arial', 'B', 12)
-    pdf.cell(0, 10, "ADDITIONAL INSTRUCTIONS", 0, 1)
-    pdf.set_font('Arial', '', 11)
-    pdf.multi_cell(0, 7, instructions)
-    pdf.ln(15)
-    
-    # Doctor information
-    pdf.set_font('Arial', 'B', 12)
-    pdf.cell(0, 10, "PRESCRIBING PHYSICIAN", 0, 1)
-    pdf.set_font('Arial', '', 11)
-    pdf.cell(0, 7, f"Name: Dr. {doctor_info['name']}", 0, 1)
-    pdf.cell(0, 7, f"Specialty: {doctor_info['specialty']}", 0, 1)
-    pdf.cell(0, 7, f"License: {doctor_info['license']}", 0, 1)
-    pdf.cell(0, 7, f"Contact: {doctor_info['contact']}", 0, 1)
-    pdf.ln(10)
-    
-    # Signature line
-    pdf.line(120, pdf.get_y(), 180, pdf.get_y())
-    pdf.set_xy(120, pdf.get_y() + 2)
-    pdf.cell(60, 5, "Doctor's Signature", 0, 0, 'C')
-    
-    # Save PDF
-    pdf_path = "medical_prescription.pdf"
-    pdf.output(pdf_path)
-    return pdf_path
-
-def create_download_link(pdf_path, filename):
-    with open(pdf_path, "rb") as f:
-        pdf_bytes = f.read()
-    b64 = base64.b64encode(pdf_bytes).decode()
-    href = f'<a href="data:application/pdf;base64,{b64}" download="{filename}">Download {filename}</a>'
-    return href
+def get_model_registry():
+    return ModelRegistry(
+        load_model_for_backend,
+        budget_bytes=MODEL_MEMORY_BUDGET_MB * 1024 * 1024,
+        runtime=start_tensorflow
+    )
+
+# Background preloader shared by all sessions. It is first created when the fracture detection
+# page renders, so TensorFlow loads (in the background) only once detection is actually used
+@st.cache_resource
+def get_model_preloader():
+    # Download the preload set in parallel while the preloader deserializes one model at a time
+    threading.Thread(
+        target=ensure_models, args=([name for name, _ in PRELOAD_MODELS],), daemon=True
+    ).start()
+    preloader = ModelPreloader(get_model_registry())
+    preloader.preload(PRELOAD_MODELS)
+    return preloader
+
+# Display-size previews shared by all sessions, keyed by content hash
+@st.cache_resource
+def get_preview_cache():
+    return PreviewCache(PREVIEW_CACHE_MB * 1024 * 1024)
+
+# Near-duplicate index shared by all sessions, loaded once from its log
+@st.cache_resource
+def get_perceptual_index():
+    os.makedirs(os.path.dirname(PHASH_INDEX_PATH) or ".", exist_ok=True)
+    return PerceptualIndex(PHASH_INDEX_PATH)
+
+# History store shared by all sessions; its writer thread batches inserts in the background
+@st.cache_resource
+def get_history_store():
+    os.makedirs(os.path.dirname(HISTORY_DB) or ".", exist_ok=True)
+    return HistoryStore(HISTORY_DB)
+
+# Prediction cache shared by all sessions in this process
+@st.cache_resource
+def get_prediction_cache():
+    return PredictionCache(
+        max_entries=CACHE_MEMORY_ENTRIES,
+        cache_dir=CACHE_DIR,
+        max_disk_bytes=CACHE_DISK_MB * 1024 * 1024
+    )
+
+# Upload types accepted by the detection page
+UPLOAD_TYPES = ["jpg", "jpeg", "png", "tif", "tiff"] + [ext.lstrip(".") for ext in DICOM_EXTENSIONS]
+
+# Content hash of an upload; each frame of a multi-frame DICOM is a separate image.
+# Hashes are remembered per upload for the session, so reruns don't rehash the bytes
+def upload_digest(uploaded_file):
+    file_id = getattr(uploaded_file, "file_id", None)
+    digests = st.session_state.setdefault("upload_digests", {})
+    digest = digests.get(file_id) if file_id else None
+    if digest is None:
+        digest = image_digest(uploaded_file.getvalue())
+        if file_id:
+            if len(digests) >= 256:
+                digests.clear()
+            digests[file_id] = digest
+    frame = getattr(uploaded_file, "dicom_frame", 0)
+    return f"{digest}:{frame}" if frame else digest
+
+# Checksum of the artifact a (model name, backend) key runs from, or None while it is unknown:
+# the local file once it exists on disk, or in client mode the service's file as reported by /health
+def model_version(model_key):
+    if INFERENCE_URL:
+        return get_inference_client().model_checksum(model_key)
+    artifact_path = artifact_path_for(*model_key)
+    if not os.path.exists(artifact_path):
+        return None
+    return file_checksum(artifact_path)
+
+# How model inputs are decoded; part of every stored result's key, since draft decodes
+# give slightly different scores (see inference.JPEG_DRAFT)
+INPUT_DECODE = "draft" if JPEG_DRAFT else "full"
+
+# Cache key for an image under a (model name, backend) artifact, or None while its version is
+# unknown. A variant (e.g. "gradcam") keys a different kind of result for the same image and model
+def prediction_cache_key(image_hash, model_key, variant=None):
+    checksum = model_version(model_key)
+    if checksum is None:
+        return None
+    model_name = "/".join(tuple(model_key) + ((variant,) if variant else ()) + (INPUT_DECODE,))
+    return PredictionCache.make_key(image_hash, model_name, checksum)
+
+# Model name and file version under which near-duplicate results are indexed, or None
+# while the version is unknown
+def indexed_model_label(model_key):
+    checksum = model_version(model_key)
+    if checksum is None:
+        return None
+    return f"{'/'.join(model_key)}/{INPUT_DECODE}@{checksum[:16]}"
+
+# Client for the shared inference service (client mode, BONESCAN_INFERENCE_URL set)
+@st.cache_resource
+def get_inference_client():
+    return InferenceClient(INFERENCE_URL)
+
+# Prefetch models as soon as the selection changes, before any upload, and show their status.
+# In client mode the inference service owns the models, so nothing is loaded in this process
+def show_model_status(model_keys):
+    if INFERENCE_URL:
+        st.caption(f"Model status: served by {INFERENCE_URL}")
+        return
+    registry = get_model_registry()
+    if registry.fits(model_keys):
+        # Only models that are not resident: a resident model needs nothing
+        for key in model_keys:
+            if not registry.is_resident(key):
+                get_model_preloader().prefetch(key)
+    else:
+        # Prefetching a selection that cannot be resident at once would evict and reload
+        # its own members on every rerun; they load one at a time during the analysis instead
+        needed_mb = sum(registry.known_size(key) or 0 for key in set(model_keys)) / (1024 * 1024)
+        st.warning(
+            f"The selected models need about {needed_mb:.0f} MB, more than the "
+            f"{MODEL_MEMORY_BUDGET_MB} MB model memory budget (BONESCAN_MODEL_MEMORY_MB), "
+            "so they are not preloaded and analyses reload them one at a time."
+        )
+    if len(model_keys) == 1:
+        st.caption(f"Model status: {get_model_preloader().status(model_keys[0])}")
+    else:
+        st.caption("Model status: " + ", ".join(
+            f"{key[0].split(' ')[0]} {get_model_preloader().status(key)}" for key in model_keys
+        ))
 
 # Streamlit App Configuration
 st.set_page_config(
@@ -239,6 +299,7 @@ def light_theme():
 # Apply initial theme
 set_theme()
 
+
 # Custom CSS (shared between themes)
 st.markdown("""
     <style>
@@ -382,15 +443,129 @@ with st.sidebar:
     with col2:
         if st.button("💊 Prescription"):
             st.session_state.current_page = 'prescription'
+    if st.button("📜 History"):
+        st.session_state.current_page = 'history'
     
     st.markdown("---")
     
     if st.session_state.current_page == 'fracture_detection':
         selected_model_name = st.selectbox(
             "🧠 Select AI Model", 
-            options=list(model_ids.keys()),
+            options=list(model_ids.keys()) + [ENSEMBLE, CASCADE],
             help="Choose the deep learning model for analysis"
         )
+        if selected_model_name == ENSEMBLE:
+            ensemble_members = st.multiselect(
+                "Ensemble Members",
+                options=list(model_ids.keys()),
+                default=list(model_ids.keys()),
+                help="Models run concurrently on the same image"
+            )
+            ensemble_method = st.selectbox("Combine By", options=COMBINE_METHODS)
+            ensemble_weights = {name: 1.0 for name in ensemble_members}
+            if ensemble_method == "weighted vote":
+                for name in ensemble_members:
+                    ensemble_weights[name] = st.slider(f"{name} weight", 0.0, 2.0, 1.0, 0.1)
+            ensemble_keys = [(name, MODEL_BACKENDS.get(name, "keras")) for name in ensemble_members]
+            selected_model_key = None
+            explain_prediction = use_tta = reuse_near_duplicates = False
+            show_model_status(ensemble_keys)
+        elif selected_model_name == CASCADE:
+            escalation_model = st.selectbox(
+                "Escalation Model",
+                options=ESCALATION_MODELS,
+                help=f"Re-scores films that {FAST_MODEL} is unsure about"
+            )
+            cascade_band = st.slider(
+                "Uncertainty Band (±)",
+                min_value=0.0, max_value=0.5, value=DEFAULT_BAND, step=0.01,
+                help=f"Films scored within this distance of {THRESHOLD} are escalated"
+            )
+            cascade_keys = [
+                (FAST_MODEL, MODEL_BACKENDS.get(FAST_MODEL, "keras")),
+                (escalation_model, MODEL_BACKENDS.get(escalation_model, "keras"))
+            ]
+            selected_model_key = None
+            explain_prediction = use_tta = reuse_near_duplicates = False
+            show_model_status(cascade_keys)
+        else:
+            selected_backend = st.selectbox(
+                "⚙ Inference Backend",
+                options=BACKENDS,
+                index=BACKENDS.index(MODEL_BACKENDS.get(selected_model_name, "keras")),
+                key=f"backend_{selected_model_name}",
+                help="TFLite backends run quantized models on the CPU interpreter"
+            )
+            selected_model_key = (selected_model_name, selected_backend)
+            show_model_status([selected_model_key])
+            
+            # Augmented views are built and scored in this process, so TTA is off in client mode
+            use_tta = st.checkbox(
+                "🔁 Test-Time Augmentation",
+                disabled=bool(INFERENCE_URL),
+                help="Scores flipped, rotated and contrast-jittered views in one batch and reports their spread"
+            ) and not INFERENCE_URL
+            
+            # Gradients need the Keras model in this process
+            gradcam_available = selected_backend == "keras" and not INFERENCE_URL and not use_tta
+            explain_prediction = st.checkbox(
+                "🔥 Grad-CAM Heatmap",
+                disabled=not gradcam_available,
+                help="Highlights the image regions behind the score (Keras backend, without TTA)"
+            ) and gradcam_available
+            
+            # Off by default: a match may be a different patient's film of the same view
+            reuse_near_duplicates = st.checkbox(
+                "♻ Reuse Near-Duplicate Results",
+                disabled=not PHASH_INDEX_PATH,
+                help="Shows the stored result of a closely matching earlier film instead of running the model; "
+                     "a reused result must be accepted before it is recorded"
+            ) and bool(PHASH_INDEX_PATH)
+        
+        # Model memory residency (of the inference service in client mode)
+        with st.expander("💾 Model Memory"):
+            registry_stats = None
+            if INFERENCE_URL:
+                try:
+                    registry_stats = get_inference_client().health()["registry"]
+                except (OSError, RuntimeError) as e:
+                    st.warning(f"Inference service unavailable: {e}")
+            else:
+                registry_stats = get_model_registry().stats()
+            if registry_stats:
+                st.markdown(
+                    f"**{registry_stats['resident_bytes'] / 2**20:.0f} MB** of "
+                    f"{registry_stats['budget_bytes'] / 2**20:.0f} MB in use  \n"
+                    f"Loads: {registry_stats['loads']} | Evictions: {registry_stats['evictions']}"
+                )
+            if registry_stats and registry_stats["models"]:
+                st.dataframe(
+                    [
+                        {
+                            "Model": " · ".join(row["model"]),
+                            "MB": round(row["bytes"] / 2**20),
+                            "In Use": row["in_use"],
+                            "Idle (s)": row["idle_seconds"]
+                        }
+                        for row in registry_stats["models"]
+                    ],
+                    hide_index=True
+                )
+        analysis_mode = st.radio(
+            "📂 Analysis Mode",
+            # Tiling runs the model in this process, so it is not offered in client mode
+            options=["Single Image", "Batch Study"] + ([] if INFERENCE_URL else [TILED]),
+            help="Batch mode scores a whole study of X-rays in a few forward passes; "
+                 "tiled mode scores overlapping full-resolution tiles to find small fractures"
+        ) if selected_model_key else "Single Image"
+        if analysis_mode == TILED:
+            tile_stride = st.slider("Tile Stride (% of tile)", min_value=25, max_value=100, value=50, step=25,
+                                    help="Lower strides overlap tiles more and score more of them")
+        if analysis_mode in ("Batch Study", TILED):
+            # Defaults to the batch size cpu_tuning.py found fastest for this model on this machine
+            batch_size = st.slider("Batch Size", min_value=1, max_value=64,
+                                   value=min(tuned_batch_size(selected_model_name, 16), 64),
+                                   help="Images (or tiles) scored per forward pass")
         
         st.markdown("---")
         st.markdown("### 🔍 About")
@@ -406,7 +581,7 @@ with st.sidebar:
         2. Select analysis model
         3. View detailed results
         """)
-    else:
+    elif st.session_state.current_page == 'prescription':
         st.markdown("### 📝 Prescription Instructions")
         st.markdown("""
         1. Fill patient information
@@ -416,12 +591,617 @@ with st.sidebar:
         5. Generate prescription
         """)
     
+    # Admin-only latency metrics
+    if ADMIN_PANEL:
+        st.markdown("---")
+        with st.expander("📈 Latency Metrics"):
+            if not metrics.enabled:
+                st.caption("Set BONESCAN_METRICS=1 to collect per-stage latencies")
+            elif metrics.snapshot():
+                st.dataframe(metrics.snapshot(), hide_index=True)
+                st.download_button(
+                    "Download Prometheus metrics",
+                    data=metrics.prometheus_text(),
+                    file_name="bonescan_metrics.prom",
+                    mime="text/plain"
+                )
+            else:
+                st.caption("No analyses recorded yet")
+    
     st.markdown("---")
     st.markdown("👨‍⚕ *Medical Disclaimer*")
     st.markdown("""
     This tool is for research purposes only. Always consult a qualified healthcare professional for medical diagnosis.
     """)
 
+# One cached result dict of `variant` (None for the plain score) for an uploaded film. On a
+# cache miss: wait for the model, decode the film at the model's input size (or at full
+# resolution), run compute(model, image, model_label) -> dict and cache what it returns.
+# In client mode, `remote()` -> dict replaces the local model when given
+def cached_model_result(uploaded_file, model_key, variant, spinner_text, compute, full_resolution=False,
+                        remote=None):
+    model_label = "/".join(model_key)
+    cache = get_prediction_cache()
+    with metrics.stage("cache_lookup", model_label):
+        image_hash = upload_digest(uploaded_file)
+        cache_key = prediction_cache_key(image_hash, model_key, variant)
+        cached = cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        return cached
+    
+    if INFERENCE_URL and remote is not None:
+        with st.spinner(spinner_text), metrics.stage("remote_predict", model_label):
+            result = remote()
+    else:
+        with st.spinner(f"🔄 Loading {model_key[0]}..."), metrics.stage("model_load", model_label):
+            get_model_preloader().wait(model_key)
+        
+        with st.spinner(spinner_text):
+            with get_model_registry().acquire(model_key) as model:
+                with metrics.stage("decode", model_label):
+                    image_file = decode_grayscale(uploaded_file, None if full_resolution else model_input_size(model))
+                result = compute(model, image_file, model_label)
+    # Re-keyed after computing: the model's version may only be known once it is loaded
+    cache.put(prediction_cache_key(image_hash, model_key, variant), result)
+    return result
+
+# Score one uploaded film with a single model, answering repeat views from the prediction cache
+def run_single_analysis(uploaded_file, model_key):
+    def compute(model, image_file, model_label):
+        with metrics.stage("preprocess", model_label):
+            processed_image = preprocess_image_tf(image_file, model)
+        with metrics.stage("predict", model_label):
+            prediction = model.predict(processed_image)
+        return {"confidence": float(prediction[0][0])}
+    
+    def remote():
+        confidence = get_inference_client().predict(
+            uploaded_file.getvalue(), model_key, getattr(uploaded_file, "dicom_frame", 0)
+        )
+        return {"confidence": confidence}
+    
+    return cached_model_result(uploaded_file, model_key, None, "🔍 Analyzing image...", compute,
+                               remote=remote)["confidence"]
+
+# Single-model analysis that also looks for a near-duplicate (rotated, re-compressed or
+# cropped copy) of an earlier film in the perceptual-hash index. The model still runs and a
+# match is only reported, unless reuse_matches opts in to showing the match's stored result
+# instead. Fresh results are added to the index. Returns the confidence and whether it was reused
+def run_indexed_analysis(uploaded_file, digest, model_key, notes, reuse_matches=False):
+    if not PHASH_INDEX_PATH:
+        return run_single_analysis(uploaded_file, model_key), False
+    with metrics.stage("perceptual_hash"):
+        hashes = perceptual_hashes(decode_grayscale(uploaded_file, (64, 64), draft=True))
+    model_label = indexed_model_label(model_key)
+    match = None
+    if model_label:
+        with metrics.stage("near_duplicate_lookup"):
+            match = get_perceptual_index().lookup(hashes, model_label)
+        if match and match["digest"] == digest:
+            match = None
+    if match and reuse_matches:
+        notes.append(("info",
+            f"This film closely matches an earlier analysis (Hamming distance {match['distance']} of 64), "
+            "so that film's stored result is shown without running the model. "
+            "Accept it for this film or re-analyze below."
+        ))
+        return match["confidence"], True
+    confidence = run_single_analysis(uploaded_file, model_key)
+    if match:
+        notes.append(("info",
+            f"This film closely matches an earlier analysis (Hamming distance {match['distance']} of 64), "
+            f"which scored {match['confidence']:.3f}."
+        ))
+    model_label = model_label or indexed_model_label(model_key)
+    if model_label:
+        get_perceptual_index().add(digest, hashes, model_label, confidence)
+    return confidence, False
+
+# Score one film and explain it with Grad-CAM in the same pass; returns the confidence and
+# heatmap, cached together per image hash. The score comes from Grad-CAM's own forward
+# model, so it is kept under the "gradcam" variant and never answers plain single-model views
+def run_explained_analysis(uploaded_file, model_key):
+    def compute(model, image_file, model_label):
+        with metrics.stage("preprocess", model_label):
+            processed_image = preprocess_image_tf(image_file, model)
+        with metrics.stage("gradcam", model_label):
+            confidence, heatmap = gradcam(model, processed_image)
+        return {"confidence": confidence, "heatmap": np.round(heatmap, 3).tolist()}
+    
+    result = cached_model_result(uploaded_file, model_key, "gradcam", "🔍 Analyzing and explaining image...", compute)
+    return result["confidence"], np.asarray(result["heatmap"], dtype=np.float32)
+
+# Score overlapping full-resolution tiles of one film. Returns the highest tile score and
+# the tile score grid (0 where the early exit skipped a tile); both are cached per image hash
+def run_tiled_analysis(uploaded_file, model_key, stride_percent, batch_size, notes):
+    def compute(model, image_file, model_label):
+        width, _ = model_input_size(model)
+        with metrics.stage("tiled_predict", model_label):
+            confidence, grid, scored = tiled_predict(
+                model, image_file, stride=width * stride_percent // 100, batch_size=batch_size
+            )
+        return {
+            "confidence": confidence,
+            "grid": np.round(np.nan_to_num(grid), 3).tolist(),
+            "tiles_scored": scored,
+            "tiles_total": int(grid.size)
+        }
+    
+    result = cached_model_result(
+        uploaded_file, model_key, f"tiled-{stride_percent}-{batch_size}", "🔍 Scanning image tiles...", compute,
+        full_resolution=True
+    )
+    early_exit = " (stopped early on a high-confidence tile)" if result["tiles_scored"] < result["tiles_total"] else ""
+    notes.append(("caption", f"Scored {result['tiles_scored']} of {result['tiles_total']} tiles{early_exit}"))
+    return result["confidence"], np.asarray(result["grid"], dtype=np.float32)
+
+# Score one film under its augmented views in a single batch; the view table and spread are
+# appended to `notes`. Results are cached per image hash
+def run_tta_analysis(uploaded_file, model_key, notes):
+    def compute(model, image_file, model_label):
+        with metrics.stage("tta_predict", model_label):
+            confidence, spread, views = tta_predict(model, image_file)
+        return {"confidence": confidence, "std": spread, "views": views}
+    
+    result = cached_model_result(uploaded_file, model_key, "tta", "🔍 Analyzing augmented views...", compute)
+    notes.append(("table", [
+        {"View": name, "Fracture Probability": round(probability, 4)}
+        for name, probability in result["views"]
+    ]))
+    notes.append(("caption", f"Mean of {len(result['views'])} views, standard deviation {result['std']:.3f}"))
+    decisions = {probability > THRESHOLD for _, probability in result["views"]}
+    if len(decisions) > 1:
+        notes.append(("info", "Augmented views disagree on the decision; treat this result as uncertain"))
+    return result["confidence"]
+
+# Score one film with several models concurrently; cached members are not re-run.
+# The per-member table is appended to `notes` (see show_analysis_notes)
+def run_ensemble_analysis(uploaded_file, member_keys, method, weights, notes):
+    if not member_keys:
+        raise ValueError("Select at least one ensemble member")
+    cache = get_prediction_cache()
+    image_hash = upload_digest(uploaded_file)
+    probabilities, latencies = {}, {}
+    pending = []
+    for key in member_keys:
+        cache_key = prediction_cache_key(image_hash, key)
+        cached = cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            probabilities[key] = cached["confidence"]
+        else:
+            pending.append(key)
+    
+    scores, wall_ms = [], 0.0
+    if pending and INFERENCE_URL:
+        with st.spinner("🔍 Running ensemble..."), metrics.stage("remote_predict", ENSEMBLE):
+            start = time.perf_counter()
+            data = uploaded_file.getvalue()
+            frame = getattr(uploaded_file, "dicom_frame", 0)
+            remote = get_inference_client().predict_many([(data, key, frame) for key in pending])
+            wall_ms = (time.perf_counter() - start) * 1000
+        scores = [(key, probability, latency_ms) for key, (probability, latency_ms) in zip(pending, remote)]
+    elif pending:
+        with st.spinner(f"🔄 Loading {len(pending)} models..."):
+            for key in pending:
+                get_model_preloader().wait(key)
+        with st.spinner("🔍 Running ensemble..."):
+            # Each input size is decoded the way run_single_analysis decodes it, so a member's
+            # score and cache entry match its single-model result.
+            # Members decode on their own threads, so each decode reads through its own file object
+            data = uploaded_file.getvalue()
+            frame = getattr(uploaded_file, "dicom_frame", 0)
+            with metrics.stage("predict", ENSEMBLE):
+                scores, wall_ms = run_ensemble(
+                    lambda size: decode_grayscale(io.BytesIO(data), size, frame=frame), pending, get_model_registry()
+                )
+    for key, probability, latency_ms in scores:
+        probabilities[key] = probability
+        latencies[key] = latency_ms
+        if metrics.enabled:
+            metrics.observe(("ensemble_member", "/".join(key)), latency_ms / 1000)
+        cache.put(prediction_cache_key(image_hash, key), {"confidence": probability})
+    
+    notes.append(("table", [
+        {
+            "Model": name,
+            "Backend": backend,
+            "Fracture Probability": round(probabilities[(name, backend)], 4),
+            "Latency (ms)": round(latencies[(name, backend)]) if (name, backend) in latencies else "cached"
+        }
+        for name, backend in member_keys
+    ]))
+    if latencies:
+        notes.append(("caption",
+            f"Ensemble wall time {wall_ms:.0f} ms "
+            f"(slowest member {max(latencies.values()):.0f} ms, sum {sum(latencies.values()):.0f} ms)"
+        ))
+    return combine(
+        [probabilities[key] for key in member_keys],
+        method,
+        [weights[name] for name, _ in member_keys]
+    )
+
+# Fast model first; escalate to the slower model only inside the uncertainty band
+def run_cascade_analysis(uploaded_file, fast_key, slow_key, band, notes):
+    fast_confidence = run_single_analysis(uploaded_file, fast_key)
+    if not needs_escalation(fast_confidence, band):
+        notes.append(("info",
+            f"Stage 1 decision by {fast_key[0]}: score {fast_confidence:.3f} is outside "
+            f"the uncertainty band {THRESHOLD} ± {band:.2f}"
+        ))
+        return fast_confidence
+    confidence = run_single_analysis(uploaded_file, slow_key)
+    notes.append(("info",
+        f"Stage 2 decision by {slow_key[0]}: {fast_key[0]} scored {fast_confidence:.3f}, "
+        f"within the uncertainty band {THRESHOLD} ± {band:.2f}"
+    ))
+    return confidence
+
+# Render the ("table" | "caption" | "image" | "info", content) notes an analysis produced
+def show_analysis_notes(notes):
+    for kind, content in notes:
+        if kind == "image":
+            image, caption = content
+            st.image(image, caption=caption, use_column_width=True)
+        elif kind == "table":
+            st.dataframe(content, use_container_width=True, hide_index=True)
+        elif kind == "caption":
+            st.caption(content)
+        else:
+            st.info(content)
+
+# Render the confidence meter, result card and recommendations for one prediction.
+# Balloons celebrate a fresh Normal result only, not redraws of a stored one
+def show_analysis_result(confidence, celebrate=True):
+    result, confidence_percent = interpret_prediction(confidence)
+    
+    # Visualization
+    st.markdown(f"""
+        <div class="confidence-meter">
+            <div class="confidence-fill" style="width: {100 - confidence_percent}%;"></div>
+        </div>
+        <div style="display: flex; justify-content: space-between; color: var(--text);">
+            <span>0%</span>
+            <span>50%</span>
+            <span>100%</span>
+        </div>
+    """, unsafe_allow_html=True)
+
+    # Results card
+    st.markdown(f"""
+        <div class="card result-card">
+            <h2>📝 Analysis Results</h2>
+            <div style="font-size: 1.2rem; margin: 1rem 0;">
+                Status: <span class="{'risk-high' if result == 'Fracture Detected' else 'risk-low'}">
+                    {result}
+                </span>
+            </div>
+            <div style="font-size: 1.2rem;">
+                Confidence: <strong>{confidence_percent:.1f}%</strong>
+            </div>
+        </div>
+    """, unsafe_allow_html=True)
+
+    # Recommendations
+    if result == "Fracture Detected":
+        st.markdown("""
+            <div class="card" style="border-left: 4px solid var(--danger);">
+                <h3>⚠ Medical Recommendation</h3>
+                <p>Our analysis indicates a potential fracture. Please:</p>
+                <ul>
+                    <li>Consult an orthopedic specialist immediately</li>
+                    <li>Immobilize the affected area</li>
+                    <li>Avoid putting weight on the injured limb</li>
+                    <li>Apply ice to reduce swelling if appropriate</li>
+                </ul>
+            </div>
+        """, unsafe_allow_html=True)
+    else:
+        st.markdown("""
+            <div class="card" style="border-left: 4px solid var(--success);">
+                <h3>✅ No Fracture Detected</h3>
+                <p>Our analysis found no evidence of fracture. However:</p>
+                <ul>
+                    <li>If pain persists, consult a healthcare provider</li>
+                    <li>Consider follow-up imaging if symptoms worsen</li>
+                    <li>Practice proper bone health with calcium and vitamin D</li>
+                </ul>
+            </div>
+        """, unsafe_allow_html=True)
+        if celebrate:
+            st.balloons()
+
+# Batch study analysis: cached films are reused, the rest share one batch tensor. Films that
+# fail the quality gate are skipped unless their digest is in `analyze_anyway`.
+# Returns the study's result rows, read errors and elapsed time for show_batch_results
+def run_batch_analysis(uploaded_files, model_key, batch_size, analyze_anyway=frozenset()):
+    model_name = model_key[0]
+    cache = get_prediction_cache()
+    start = time.time()
+    rejected = []
+    if QUALITY_GATE:
+        with metrics.stage("quality_gate"):
+            reports = [assess_quality(f) for f in uploaded_files]
+        # Failing films stay listed (with their override) even once the user analyses them anyway
+        rejected = [
+            (f.name, report["issues"], upload_digest(f))
+            for f, report in zip(uploaded_files, reports) if not report["passed"]
+        ]
+        uploaded_files = [
+            f for f, report in zip(uploaded_files, reports) if report["passed"] or upload_digest(f) in analyze_anyway
+        ]
+    digests = [upload_digest(f) for f in uploaded_files]
+    # Keyed by position in the study: two films may share a file name
+    results, pending = {}, []
+    for position, digest in enumerate(digests):
+        cached = cache.get(prediction_cache_key(digest, model_key))
+        if cached is not None:
+            results[position] = cached["confidence"]
+        else:
+            pending.append(position)
+
+    errors = []
+    if pending and INFERENCE_URL:
+        # One request per film; the service batches them together with other sessions' requests
+        with st.spinner(f"🔍 Analyzing {len(pending)} images..."), metrics.stage("remote_predict", "/".join(model_key)):
+            remote = get_inference_client().predict_many(
+                [(uploaded_files[position].getvalue(), model_key) for position in pending], return_exceptions=True
+            )
+        for position, outcome in zip(pending, remote):
+            if isinstance(outcome, Exception):
+                errors.append((uploaded_files[position].name, str(outcome)))
+                continue
+            results[position] = outcome[0]
+            cache.put(prediction_cache_key(digests[position], model_key), {"confidence": outcome[0]})
+    elif pending:
+        with st.spinner(f"🔄 Loading {model_name}..."), metrics.stage("model_load", "/".join(model_key)):
+            get_model_preloader().wait(model_key)
+
+        with st.spinner(f"🔍 Analyzing {len(pending)} images..."):
+            with get_model_registry().acquire(model_key) as model:
+                with metrics.stage("batch_preprocess", "/".join(model_key)):
+                    batch, decoded, errors = preprocess_batch_tf([uploaded_files[position] for position in pending], model)
+                with metrics.stage("batch_predict", "/".join(model_key)):
+                    scores = predict_batch(model, batch, batch_size) if len(decoded) else []
+            for index, confidence in zip(decoded, scores):
+                position = pending[index]
+                results[position] = float(confidence)
+                cache.put(prediction_cache_key(digests[position], model_key), {"confidence": float(confidence)})
+    elapsed = time.time() - start
+
+    rows, hashes = [], []
+    for position, uploaded_file in enumerate(uploaded_files):
+        if position not in results:
+            continue
+        result, confidence_percent = interpret_prediction(results[position])
+        rows.append({
+            "File": uploaded_file.name,
+            "Result": result,
+            "Confidence (%)": round(confidence_percent, 1),
+            "Fracture Probability": round(float(results[position]), 4)
+        })
+        hashes.append(digests[position])
+    # hashes[i] is the content hash of rows[i]
+    return {"rows": rows, "errors": errors, "rejected": rejected, "elapsed": elapsed, "hashes": hashes}
+
+def show_batch_results(study):
+    for name, issues, digest in study["rejected"]:
+        st.warning(f"{name} did not pass the quality check: " + " ".join(issues))
+        st.checkbox(f"Analyze {name} anyway", key=f"quality_override_{digest}")
+    for name, error in study["errors"]:
+        st.error(f"Error reading {name}: {error}")
+    rows, elapsed = study["rows"], study["elapsed"]
+    if not rows:
+        return
+    fractures = sum(1 for row in rows if row["Result"] == "Fracture Detected")
+
+    st.markdown(f"""
+        <div class="card result-card">
+            <h2>📝 Study Results</h2>
+            <div style="font-size: 1.2rem; margin: 1rem 0;">
+                Fractures: <span class="{'risk-high' if fractures else 'risk-low'}">{fractures}</span>
+                of {len(rows)} images
+            </div>
+            <div style="font-size: 1rem;">
+                Analyzed in <strong>{elapsed:.1f}s</strong> ({elapsed / len(rows) * 1000:.0f} ms per image)
+            </div>
+        </div>
+    """, unsafe_allow_html=True)
+    st.dataframe(rows, use_container_width=True, hide_index=True)
+
+# Digests of the study films the user chose to analyse despite a failed quality check
+def quality_overrides(uploaded_files):
+    return frozenset(
+        digest for digest in map(upload_digest, uploaded_files)
+        if st.session_state.get(f"quality_override_{digest}")
+    )
+
+# Identifies everything a stored result depends on: the uploaded files and the model settings
+def analysis_signature(uploaded_files):
+    file_ids = tuple(
+        (getattr(f, "file_id", None) or (f.name, f.size), getattr(f, "dicom_frame", 0)) for f in uploaded_files
+    )
+    if analysis_mode == "Batch Study":
+        return ("batch", file_ids, selected_model_key, quality_overrides(uploaded_files))
+    if selected_model_name == ENSEMBLE:
+        return (ENSEMBLE, file_ids, tuple(ensemble_keys), ensemble_method, tuple(sorted(ensemble_weights.items())))
+    if selected_model_name == CASCADE:
+        return (CASCADE, file_ids, tuple(cascade_keys), cascade_band)
+    if analysis_mode == TILED:
+        return (TILED, file_ids, selected_model_key, tile_stride, batch_size)
+    return ("single", file_ids, selected_model_key, explain_prediction, use_tta, reuse_near_duplicates)
+
+# Model and mode recorded in the history for the current sidebar settings
+def history_label():
+    if analysis_mode == "Batch Study":
+        return "/".join(selected_model_key), "batch"
+    if selected_model_name == ENSEMBLE:
+        return f"{ensemble_method}: " + " + ".join("/".join(key) for key in ensemble_keys), "ensemble"
+    if selected_model_name == CASCADE:
+        return " > ".join("/".join(key) for key in cascade_keys), "cascade"
+    if analysis_mode == TILED:
+        return "/".join(selected_model_key), "tiled"
+    if use_tta:
+        return "/".join(selected_model_key), "tta"
+    return "/".join(selected_model_key), "gradcam" if explain_prediction else "single"
+
+# Queue a stored result for the history once. A patient ID or licence entered or corrected
+# afterwards updates the rows already recorded for it instead of adding new ones
+def record_analysis_history(stored, patient_id, doctor_license):
+    if stored.get("recorded") == (patient_id, doctor_license):
+        return
+    stored["recorded"] = (patient_id, doctor_license)
+    history = get_history_store()
+    if "history_tokens" in stored:
+        for token in stored["history_tokens"]:
+            history.update_analysis(token, patient_id, doctor_license)
+        return
+    model, mode = stored["history"]
+    if "study" in stored:
+        stored["history_tokens"] = [
+            history.record_analysis(
+                image_hash, model, mode, row["Fracture Probability"],
+                stored["timings"], patient_id, doctor_license
+            )
+            for row, image_hash in zip(stored["study"]["rows"], stored["study"]["hashes"])
+        ]
+    else:
+        stored["history_tokens"] = [history.record_analysis(
+            stored["image_hash"], model, mode, stored["confidence"], stored["timings"], patient_id, doctor_license
+        )]
+
+# Upload and analysis area. Results live in session state under their analysis_signature, so a
+# rerun from an unrelated widget (theme toggle, navigation) only redraws them; as a fragment,
+# the uploader's own interactions rerun just this function instead of the whole page
+@fragment
+def show_detection_workspace():
+    # Optional; recorded with each analysis in the history
+    id_col, license_col = st.columns(2)
+    patient_id = id_col.text_input("Patient ID", placeholder="Optional").strip()
+    doctor_license = license_col.text_input("Doctor License", placeholder="Optional").strip()
+
+    if analysis_mode == "Batch Study":
+        uploaded_files = st.file_uploader(
+            "Drag and drop or click to upload",
+            type=UPLOAD_TYPES,
+            accept_multiple_files=True,
+            label_visibility="collapsed"
+        )
+        if uploaded_files:
+            try:
+                signature = analysis_signature(uploaded_files)
+                stored = st.session_state.get("detection_result")
+                if stored is None or stored["signature"] != signature:
+                    with metrics.trace() as timings:
+                        study = run_batch_analysis(
+                            uploaded_files, selected_model_key, batch_size, quality_overrides(uploaded_files)
+                        )
+                    stored = {"signature": signature, "study": study, "timings": timings, "history": history_label()}
+                    st.session_state.detection_result = stored
+                show_batch_results(stored["study"])
+                record_analysis_history(stored, patient_id, doctor_license)
+            except Exception as e:
+                st.error(f"Error analyzing the study: {str(e)}")
+        return
+
+    uploaded_file = st.file_uploader(
+        "Drag and drop or click to upload", 
+        type=UPLOAD_TYPES,
+        label_visibility="collapsed"
+    )
+    if not uploaded_file:
+        return
+    try:
+        # Multi-frame DICOM: analyse one frame at a time
+        if is_dicom(uploaded_file):
+            frames = frame_count(uploaded_file)
+            uploaded_file.dicom_frame = st.slider("Frame", 1, frames, 1) - 1 if frames > 1 else 0
+        
+        # A display-width thumbnail, encoded once per image, instead of the full-resolution file
+        digest = upload_digest(uploaded_file)
+        with metrics.stage("image_display"):
+            preview = get_preview_cache().get_or_create(
+                (digest, PREVIEW_WIDTH), lambda: make_thumbnail(uploaded_file)
+            )
+            st.image(preview, caption="Uploaded X-ray", use_column_width=True)
+        
+        # Full-resolution detail is decoded only while zoom is switched on
+        if st.toggle("🔍 Zoom into full resolution"):
+            zoom = st.select_slider("Magnification", options=[2, 4, 8], value=2, format_func=lambda z: f"{z}×")
+            center_x = st.slider("Horizontal position", 0.0, 1.0, 0.5, 0.05)
+            center_y = st.slider("Vertical position", 0.0, 1.0, 0.5, 0.05)
+            with metrics.stage("zoom_display"):
+                zoomed = get_preview_cache().get_or_create(
+                    (digest, PREVIEW_WIDTH, zoom, center_x, center_y),
+                    lambda: zoom_view(uploaded_file, center_x, center_y, zoom)
+                )
+                st.image(zoomed, caption=f"{zoom}× detail", use_column_width=True)
+        
+        signature = analysis_signature([uploaded_file])
+        stored = st.session_state.get("detection_result")
+        near_duplicate_key = f"near_duplicate_{digest}"
+        reanalyze = st.session_state.get(near_duplicate_key) == REANALYZE
+        fresh = stored is None or stored["signature"] != signature or (stored.get("near_duplicate") and reanalyze)
+        if fresh and QUALITY_GATE:
+            # Junk uploads stop here, before any model is loaded or called
+            with metrics.stage("quality_gate"):
+                quality = assess_quality(uploaded_file)
+            if not quality["passed"]:
+                st.warning(
+                    "⚠ This image did not pass the quality check:\n\n"
+                    + "\n".join(f"- {issue}" for issue in quality["issues"])
+                )
+                if not st.checkbox("Analyze anyway", key=f"quality_override_{digest}"):
+                    return
+        if fresh:
+            with metrics.trace() as timings:
+                notes = []
+                near_duplicate = False
+                if analysis_mode == TILED:
+                    confidence, grid = run_tiled_analysis(uploaded_file, selected_model_key, tile_stride, batch_size, notes)
+                    overlay = overlay_heatmap(
+                        decode_grayscale(uploaded_file, (OVERLAY_WIDTH, OVERLAY_WIDTH), draft=True), grid
+                    )
+                    notes.append(("image", (overlay, "Tile fracture scores")))
+                elif selected_model_name == ENSEMBLE:
+                    confidence = run_ensemble_analysis(
+                        uploaded_file, ensemble_keys, ensemble_method, ensemble_weights, notes
+                    )
+                elif selected_model_name == CASCADE:
+                    confidence = run_cascade_analysis(uploaded_file, *cascade_keys, cascade_band, notes)
+                elif use_tta:
+                    confidence = run_tta_analysis(uploaded_file, selected_model_key, notes)
+                elif explain_prediction:
+                    confidence, heatmap = run_explained_analysis(uploaded_file, selected_model_key)
+                    with metrics.stage("gradcam_overlay"):
+                        overlay = overlay_heatmap(
+                            decode_grayscale(uploaded_file, (OVERLAY_WIDTH, OVERLAY_WIDTH), draft=True), heatmap
+                        )
+                    notes.append(("image", (overlay, "Grad-CAM: regions driving the fracture score")))
+                else:
+                    confidence, near_duplicate = run_indexed_analysis(
+                        uploaded_file, digest, selected_model_key, notes,
+                        reuse_matches=reuse_near_duplicates and not reanalyze
+                    )
+            model, mode = history_label()
+            stored = {"signature": signature, "confidence": confidence, "notes": notes,
+                      "near_duplicate": near_duplicate, "image_hash": digest, "timings": timings,
+                      "history": (model, "near-duplicate" if near_duplicate else mode)}
+            st.session_state.detection_result = stored
+        show_analysis_notes(stored["notes"])
+        if stored.get("near_duplicate"):
+            st.radio("Reused result", options=[ACCEPT_REUSED, REANALYZE], index=None, key=near_duplicate_key)
+        with metrics.stage("render"):
+            show_analysis_result(stored["confidence"], celebrate=fresh)
+        # A reused score only becomes this patient's analysis once the user accepts it
+        if not stored.get("near_duplicate") or st.session_state.get(near_duplicate_key) == ACCEPT_REUSED:
+            record_analysis_history(stored, patient_id, doctor_license)
+        if fresh:
+            metrics.export()
+                
+    except Exception as e:
+        st.error(f"Error analyzing the image: {str(e)}")
+
 # Fracture Detection Page
 def show_fracture_detection():
     # Header Section
@@ -473,94 +1253,7 @@ def show_fracture_detection():
                 <p>For best results, use clear, high-contrast images of the affected area.</p>
             </div>
         """, unsafe_allow_html=True)
-        
-        uploaded_file = st.file_uploader(
-            "Drag and drop or click to upload", 
-            type=["jpg", "jpeg", "png"],
-            label_visibility="collapsed"
-        )
-        
-        if uploaded_file:
-            try:
-                image_file = Image.open(uploaded_file).convert("RGB")
-                st.image(
-                    uploaded_file, 
-                    caption="Uploaded X-ray", 
-                    use_column_width=True,
-                    output_format="PNG"
-                )
-                
-                # Load selected model
-                with st.spinner(f"🔄 Loading {selected_model_name}..."):
-                    file_id = model_ids[selected_model_name]
-                    model = load_tensorflow_model(file_id, selected_model_name.replace(" ", "_"))
-                    
-                with st.spinner("🔍 Analyzing image..."):
-                    processed_image = preprocess_image_tf(image_file, model)
-                    prediction = model.predict(processed_image)
-                    confidence = prediction[0][0]
-                    
-                    result = "Fracture Detected" if confidence > 0.5 else "Normal"
-                    confidence_score = confidence if result == "Fracture Detected" else 1 - confidence
-                    confidence_percent = confidence_score * 100
-                    
-                    # Visualization
-                    st.markdown(f"""
-                        <div class="confidence-meter">
-                            <div class="confidence-fill" style="width: {100 - confidence_percent}%;"></div>
-                        </div>
-                        <div style="display: flex; justify-content: space-between; color: var(--text);">
-                            <span>0%</span>
-                            <span>50%</span>
-                            <span>100%</span>
-                        </div>
-                    """, unsafe_allow_html=True)
-                    
-                    # Results card
-                    st.markdown(f"""
-                        <div class="card result-card">
-                            <h2>📝 Analysis Results</h2>
-                            <div style="font-size: 1.2rem; margin: 1rem 0;">
-                                Status: <span class="{'risk-high' if result == 'Fracture Detected' else 'risk-low'}">
-                                    {result}
-                                </span>
-                            </div>
-                            <div style="font-size: 1.2rem;">
-                                Confidence: <strong>{confidence_percent:.1f}%</strong>
-                            </div>
-                        </div>
-                    """, unsafe_allow_html=True)
-                    
-                    # Recommendations
-                    if result == "Fracture Detected":
-                        st.markdown("""
-                            <div class="card" style="border-left: 4px solid var(--danger);">
-                                <h3>⚠ Medical Recommendation</h3>
-                                <p>Our analysis indicates a potential fracture. Please:</p>
-                                <ul>
-                                    <li>Consult an orthopedic specialist immediately</li>
-                                    <li>Immobilize the affected area</li>
-                                    <li>Avoid putting weight on the injured limb</li>
-                                    <li>Apply ice to reduce swelling if appropriate</li>
-                                </ul>
-                            </div>
-                        """, unsafe_allow_html=True)
-                    else:
-                        st.markdown("""
-                            <div class="card" style="border-left: 4px solid var(--success);">
-                                <h3>✅ No Fracture Detected</h3>
-                                <p>Our analysis found no evidence of fracture. However:</p>
-                                <ul>
-                                    <li>If pain persists, consult a healthcare provider</li>
-                                    <li>Consider follow-up imaging if symptoms worsen</li>
-                                    <li>Practice proper bone health with calcium and vitamin D</li>
-                                </ul>
-                            </div>
-                        """, unsafe_allow_html=True)
-                        st.balloons()
-                        
-            except Exception as e:
-                st.error(f"Error analyzing the image: {str(e)}")
+        show_detection_workspace()
 
     with main_col2:
         st.markdown("""
@@ -607,19 +1300,10 @@ def show_fracture_detection():
         </div>
     """, unsafe_allow_html=True)
 
-# Prescription Generator Page
-def show_prescription_generator():
-    st.markdown("""
-        <div style="background: linear-gradient(135deg, var(--primary), var(--primary-dark));
-                    color: white;
-                    padding: 2rem;
-                    border-radius: 0 0 12px 12px;
-                    margin: -1rem -1rem 2rem -1rem;
-                    text-align: center;">
-            <h1>Medical Prescription Generator</h1>
-            <h3 style="font-weight: 400;">BoneScan AI Clinical System</h3>
-        </div>
-    """, unsafe_allow_html=True)
+# Single prescription form
+def show_prescription_form():
+    # Outside the form so changing it re-renders the medication fields
+    medication_count = st.number_input("Number of medications", min_value=1, max_value=20, value=3)
 
     # Main form
     with st.form("prescription_form"):
@@ -641,7 +1325,7 @@ def show_prescription_generator():
         st.markdown("### Prescribed Medications")
         
         medications = []
-        for i in range(3):  # Allow up to 3 medications
+        for i in range(medication_count):
             with st.expander(f"Medication {i+1}", expanded=(i==0)):
                 med_col1, med_col2, med_col3, med_col4 = st.columns(4)
                 with med_col1:
@@ -701,23 +1385,132 @@ def show_prescription_generator():
                         'contact': doctor_contact
                     }
                     
-                    pdf_path = create_prescription(
-                        patient_info=patient_info,
-                        diagnosis=diagnosis,
-                        medications=medications,
-                        instructions=instructions,
-                        doctor_info=doctor_info
+                    prescription_id = f"RX-{datetime.now().strftime('%Y%m%d%H%M')}"
+                    with metrics.trace() as timings, metrics.stage("prescription_total"):
+                        pdf_bytes = create_prescription(
+                            patient_info=patient_info,
+                            diagnosis=diagnosis,
+                            medications=medications,
+                            instructions=instructions,
+                            doctor_info=doctor_info,
+                            prescription_id=prescription_id
+                        )
+                    metrics.export()
+                    get_history_store().record_prescription(
+                        patient_id, doctor_license, prescription_id, diagnosis, len(medications), timings=timings
                     )
                     
+                    # Kept per session, so concurrent users never see each other's PDFs;
+                    # the preview payload is encoded once here rather than on every rerun
+                    st.session_state.prescription = {
+                        'pdf': pdf_bytes,
+                        'base64': base64.b64encode(pdf_bytes).decode('utf-8')
+                    }
                     st.success("Prescription generated successfully!")
-                    st.markdown(create_download_link(pdf_path, "Medical_Prescription.pdf"), unsafe_allow_html=True)
-                    
-                    # Preview
-                    st.markdown("### Prescription Preview")
-                    with open(pdf_path, "rb") as f:
-                        base64_pdf = base64.b64encode(f.read()).decode('utf-8')
-                    pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}" width="100%" height="600" type="application/pdf"></iframe>'
-                    st.markdown(pdf_display, unsafe_allow_html=True)
+
+    # Download buttons are not allowed inside forms, so the result renders below it
+    if 'prescription' in st.session_state:
+        st.download_button(
+            "Download Medical_Prescription.pdf",
+            data=st.session_state.prescription['pdf'],
+            file_name="Medical_Prescription.pdf",
+            mime="application/pdf"
+        )
+        
+        # The inline PDF is a large payload re-sent on every rerun it is part of, so it is only
+        # rendered while asked for, not on reruns from unrelated widgets
+        if st.toggle("👁 Preview prescription", key="prescription_preview"):
+            st.markdown("### Prescription Preview")
+            base64_pdf = st.session_state.prescription['base64']
+            pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}" width="100%" height="600" type="application/pdf"></iframe>'
+            st.markdown(pdf_display, unsafe_allow_html=True)
+
+# Bulk prescriptions: PDFs render in worker processes straight into a ZIP on disk
+def show_bulk_prescriptions():
+    st.markdown("""
+        <div class="card upload-card">
+            <h2>📄 Bulk Prescriptions</h2>
+            <p>Upload a CSV (one row per medication) or JSONL (one prescription per line) of patients,
+            medications and prescribing physicians.</p>
+        </div>
+    """, unsafe_allow_html=True)
+    records_file = st.file_uploader("Prescription records", type=["csv", "jsonl", "json"])
+    cpus = os.cpu_count() or 1
+    # A slider needs two distinct ends, so single-core machines get no choice
+    workers = st.slider("Worker processes", min_value=1, max_value=cpus, value=cpus) if cpus > 1 else 1
+
+    if records_file and st.button("Generate Prescriptions"):
+        rows = []
+        status = st.empty()
+        start = time.time()
+        # Named, so an archive too large to download can be left on disk for the operator
+        with tempfile.NamedTemporaryFile(prefix="bonescan_prescriptions_", suffix=".zip", delete=False) as zip_file:
+            try:
+                records = iter_records(text_stream(records_file), detect_format(records_file.name))
+                history = get_history_store()
+                for row in generate_zip(records, zip_file, workers=workers):
+                    rows.append(row)
+                    if not row["error"]:
+                        history.record_prescription(
+                            row["patient_id"], row["doctor_license"], row["prescription_id"], row["diagnosis"],
+                            row["medications"], source="bulk", timings={"render": row["render_ms"] / 1000}
+                        )
+                    status.info(f"Rendered {len(rows)} prescriptions...")
+            except BaseException:
+                zip_file.close()
+                os.remove(zip_file.name)
+                raise
+        elapsed = time.time() - start
+        rendered = [row for row in rows if not row["error"]]
+        status.empty()
+        st.success(f"{len(rendered)} of {len(rows)} prescriptions generated in {elapsed:.1f}s")
+        archive_mb = os.path.getsize(zip_file.name) / (1024 * 1024)
+        if rendered and archive_mb > BULK_DOWNLOAD_MB:
+            st.info(
+                f"The archive is {archive_mb:.0f} MB, more than the {BULK_DOWNLOAD_MB} MB that can be "
+                f"downloaded here (BONESCAN_BULK_DOWNLOAD_MB). It was saved on the server as "
+                f"{zip_file.name}. For batches this large, run "
+                f"`python bulk_prescriptions.py {records_file.name} --output prescriptions.zip` instead."
+            )
+        else:
+            if rendered:
+                with open(zip_file.name, "rb") as archive:
+                    st.download_button(
+                        "Download Prescriptions.zip",
+                        data=archive,
+                        file_name="Prescriptions.zip",
+                        mime="application/zip"
+                    )
+            os.remove(zip_file.name)
+        failed = len(rows) - len(rendered)
+        if failed:
+            st.warning(f"{failed} records were skipped; see the error column below")
+        st.dataframe(sorted(rows, key=lambda row: row["document"]), use_container_width=True, hide_index=True)
+
+# Prescription Generator Page
+def show_prescription_generator():
+    st.markdown("""
+        <div style="background: linear-gradient(135deg, var(--primary), var(--primary-dark));
+                    color: white;
+                    padding: 2rem;
+                    border-radius: 0 0 12px 12px;
+                    margin: -1rem -1rem 2rem -1rem;
+                    text-align: center;">
+            <h1>Medical Prescription Generator</h1>
+            <h3 style="font-weight: 400;">BoneScan AI Clinical System</h3>
+        </div>
+    """, unsafe_allow_html=True)
+
+    prescription_mode = st.radio(
+        "Mode",
+        options=["Single Prescription", "Bulk (CSV/JSONL)"],
+        horizontal=True,
+        label_visibility="collapsed"
+    )
+    if prescription_mode == "Bulk (CSV/JSONL)":
+        show_bulk_prescriptions()
+    else:
+        show_prescription_form()
 
     # Footer
     st.markdown("---")
@@ -728,8 +1521,57 @@ def show_prescription_generator():
         </div>
     """, unsafe_allow_html=True)
 
+# History page: one keyset-paginated page at a time, newest first. The cursor stack in session
+# state holds the last id of each earlier page, so "Older" and "Newer" are both index seeks
+def show_history():
+    st.markdown("""
+        <div class="header">
+            <h1 style="text-align: center; margin-bottom: 0.5rem;">📜 History</h1>
+            <h3 style="text-align: center; font-weight: 300; margin-top: 0;">
+                Recorded analyses and prescriptions
+            </h3>
+        </div>
+    """, unsafe_allow_html=True)
+
+    table = st.radio("Records", options=["analyses", "prescriptions"], horizontal=True,
+                     format_func=str.capitalize, label_visibility="collapsed")
+    filter_col1, filter_col2, filter_col3, filter_col4 = st.columns([2, 2, 3, 1])
+    filters = {"patient_id": filter_col1.text_input("Patient ID").strip()}
+    if table == "prescriptions":
+        filters["doctor_license"] = filter_col2.text_input("Doctor License").strip()
+    dates = filter_col3.date_input("Dates", value=(), help="One day or a range")
+    since, until = (tuple(dates) + (None, None))[:2]
+    page_size = filter_col4.selectbox("Rows", options=[25, 50, 100])
+
+    query = (table, tuple(filters.items()), since, until, page_size)
+    if st.session_state.get("history_query") != query:
+        st.session_state.history_query = query
+        st.session_state.history_cursors = [None]
+    cursors = st.session_state.history_cursors
+
+    history = get_history_store()
+    # Give rows queued by this session's last analysis a moment to land, without waiting on a backlog
+    history.flush(timeout=0.25)
+    rows, next_cursor = history.page(table, filters, since, until or since, before=cursors[-1], limit=page_size)
+    if rows:
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+    else:
+        st.info("No records match these filters")
+
+    newer_col, page_col, older_col = st.columns([1, 2, 1])
+    newer_col.button("← Newer", disabled=len(cursors) == 1, on_click=cursors.pop)
+    page_col.markdown(f"<div style='text-align: center;'>Page {len(cursors)}</div>", unsafe_allow_html=True)
+    older_col.button("Older →", disabled=next_cursor is None, on_click=cursors.append, args=(next_cursor,))
+
+    stats = history.stats()
+    if stats["dropped"] or stats["failed"]:
+        st.warning(f"{stats['dropped']} records were dropped (write queue full) and "
+                   f"{stats['failed']} failed to write since the app started")
+
 # Main App Logic
 if st.session_state.current_page == 'fracture_detection':
     show_fracture_detection()
+elif st.session_state.current_page == 'history':
+    show_history()
 else:
     show_prescription_generator()
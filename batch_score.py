@@ -0,0 +1,166 @@
+# Headless batch scoring for directories or globs of X-rays, e.g. nightly PACS exports:
+#   python batch_score.py /data/pacs_export --model "MobileNet (Keras)" --output scores.jsonl
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from inference import (
+    model_ids, load_named_model, model_input_size, decode_grayscale, grayscale_plane,
+    predict_batch, interpret_prediction
+)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".dcm", ".dicom")
+OUTPUT_FIELDS = ["path", "model", "result", "confidence", "fracture_probability", "error"]
+
+
+# Lazily walk a directory tree or expand a glob, never listing the whole archive up front
+def iter_image_paths(source):
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(root, name)
+    else:
+        for path in glob.iglob(source, recursive=True):
+            if os.path.isfile(path):
+                yield path
+
+
+# Decode and preprocess one file to a single float32 plane; runs on a worker thread
+def load_image(path, size):
+    try:
+        with decode_grayscale(path, size) as image:
+            return path, grayscale_plane(image, size), None
+    except Exception as e:
+        return path, None, str(e)
+
+
+# Ordered prefetch pipeline: at most `prefetch` decodes are in flight at once, so memory
+# stays flat however large the archive is, and decoding overlaps with inference
+def prefetch_images(paths, size, workers, prefetch):
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="decode") as executor:
+        pending = deque()
+        for path in paths:
+            pending.append(executor.submit(load_image, path, size))
+            if len(pending) >= prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class JsonlWriter:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, row):
+        self.stream.write(json.dumps(row) + "\n")
+
+    def flush(self):
+        self.stream.flush()
+
+
+class CsvWriter:
+    def __init__(self, stream):
+        self.stream = stream
+        self.writer = csv.DictWriter(stream, fieldnames=OUTPUT_FIELDS)
+        self.writer.writeheader()
+
+    def write(self, row):
+        self.writer.writerow(row)
+
+    def flush(self):
+        self.stream.flush()
+
+
+# Stream images through the model in fixed-size batches, writing each batch as it completes
+def score(paths, model, model_name, writer, batch_size=32, workers=4, prefetch=64, progress_every=1000):
+    buffer = np.empty((batch_size,) + tuple(model.input_shape[1:]), dtype=np.float32)
+    batch_paths = []
+    counts = {"scored": 0, "failed": 0}
+    start = time.time()
+    next_report = progress_every
+
+    def flush_batch():
+        scores = predict_batch(model, buffer[:len(batch_paths)], batch_size)
+        for path, confidence in zip(batch_paths, scores):
+            result, confidence_percent = interpret_prediction(confidence)
+            writer.write({
+                "path": path,
+                "model": model_name,
+                "result": result,
+                "confidence": round(confidence_percent, 2),
+                "fracture_probability": round(float(confidence), 6),
+                "error": ""
+            })
+        counts["scored"] += len(batch_paths)
+        batch_paths.clear()
+        writer.flush()
+
+    for path, plane, error in prefetch_images(paths, model_input_size(model), workers, prefetch):
+        if error is not None:
+            writer.write({"path": path, "model": model_name, "result": "", "confidence": "",
+                          "fracture_probability": "", "error": error})
+            counts["failed"] += 1
+            continue
+        buffer[len(batch_paths)] = plane[:, :, None]
+        batch_paths.append(path)
+        if len(batch_paths) == batch_size:
+            flush_batch()
+            if progress_every and counts["scored"] >= next_report:
+                next_report += progress_every
+                rate = counts["scored"] / max(time.time() - start, 1e-9)
+                print(f"{counts['scored']} scored, {counts['failed']} failed ({rate:.1f} images/s)",
+                      file=sys.stderr)
+    if batch_paths:
+        flush_batch()
+    writer.flush()
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score X-ray images without the Streamlit UI")
+    parser.add_argument("source", help="directory (scanned recursively) or glob pattern, e.g. 'export/**/*.jpg'")
+    parser.add_argument("--model", default="MobileNet (Keras)", choices=list(model_ids))
+    parser.add_argument("--backend", default="keras", choices=["keras", "tflite-float16", "tflite-int8"])
+    parser.add_argument("--output", "-o", default="-", help="output file, '-' for stdout")
+    parser.add_argument("--format", choices=["jsonl", "csv"],
+                        help="output format (default: from the output extension, else jsonl)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=min(8, os.cpu_count() or 1),
+                        help="decode/resize worker threads")
+    parser.add_argument("--prefetch", type=int, help="max images decoded ahead (default: 2x batch size)")
+    args = parser.parse_args(argv)
+
+    output_format = args.format or ("csv" if args.output.lower().endswith(".csv") else "jsonl")
+    if args.backend == "keras":
+        model = load_named_model(args.model)
+    else:
+        from tflite_backend import load_model_for_backend
+        model = load_model_for_backend((args.model, args.backend))
+    stream = sys.stdout if args.output == "-" else open(args.output, "w", newline="")
+    try:
+        writer = CsvWriter(stream) if output_format == "csv" else JsonlWriter(stream)
+        start = time.time()
+        counts = score(
+            iter_image_paths(args.source), model, args.model, writer,
+            batch_size=args.batch_size, workers=args.workers,
+            prefetch=args.prefetch or 2 * args.batch_size
+        )
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+    elapsed = time.time() - start
+    print(f"Done: {counts['scored']} scored, {counts['failed']} failed in {elapsed:.1f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+# Bulk prescription generation from CSV or JSONL: PDFs render in worker processes and
+# are streamed into a ZIP as they complete, so the batch never sits in memory at once.
+#   python bulk_prescriptions.py patients.jsonl --output prescriptions.zip
+#
+# JSONL: one prescription per line with "patient", "diagnosis", "medications" (a list),
+# "instructions" and "doctor" keys, using the same fields as the prescription form.
+# CSV: one row per medication; consecutive rows for the same patient and doctor become
+# one prescription. Columns: patient_name, patient_age, patient_gender, patient_id,
+# patient_allergies, diagnosis, instructions, doctor_name, doctor_specialty,
+# doctor_license, doctor_contact, med_name, med_dosage, med_frequency, med_duration,
+# med_instructions
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
+from datetime import datetime
+from itertools import groupby
+
+from prescription import create_prescription
+
+REQUIRED_PATIENT_FIELDS = ["name", "age", "id"]
+REQUIRED_DOCTOR_FIELDS = ["name", "specialty", "license"]
+
+
+def _medication(row, prefix=""):
+    return {
+        'name': row.get(f"{prefix}name", ""),
+        'dosage': row.get(f"{prefix}dosage", ""),
+        'frequency': row.get(f"{prefix}frequency", ""),
+        'duration': row.get(f"{prefix}duration", ""),
+        'special_instructions': row.get(f"{prefix}special_instructions", row.get(f"{prefix}instructions", ""))
+    }
+
+
+def _record_from_json(data):
+    patient = data.get("patient", {})
+    doctor = data.get("doctor", {})
+    return {
+        'patient_info': {
+            'name': patient.get("name", ""),
+            'age': str(patient.get("age", "")),
+            'gender': patient.get("gender", "Other"),
+            'id': str(patient.get("id", "")),
+            'allergies': patient.get("allergies", "None")
+        },
+        'diagnosis': data.get("diagnosis", ""),
+        'medications': [_medication(med) for med in data.get("medications", [])],
+        'instructions': data.get("instructions", ""),
+        'doctor_info': {
+            'name': doctor.get("name", ""),
+            'specialty': doctor.get("specialty", ""),
+            'license': doctor.get("license", ""),
+            'contact': doctor.get("contact", "")
+        }
+    }
+
+
+def _record_from_rows(rows):
+    first = rows[0]
+    return {
+        'patient_info': {
+            'name': first.get("patient_name", ""),
+            'age': first.get("patient_age", ""),
+            'gender': first.get("patient_gender") or "Other",
+            'id': first.get("patient_id", ""),
+            'allergies': first.get("patient_allergies") or "None"
+        },
+        'diagnosis': first.get("diagnosis", ""),
+        'medications': [_medication(row, "med_") for row in rows if row.get("med_name")],
+        'instructions': first.get("instructions", ""),
+        'doctor_info': {
+            'name': first.get("doctor_name", ""),
+            'specialty': first.get("doctor_specialty", ""),
+            'license': first.get("doctor_license", ""),
+            'contact': first.get("doctor_contact", "")
+        }
+    }
+
+
+# Lazily parse prescription records from a text stream
+def iter_records(stream, file_format):
+    if file_format == "jsonl":
+        for line in stream:
+            if line.strip():
+                yield _record_from_json(json.loads(line))
+    else:
+        reader = csv.DictReader(stream)
+        for _, rows in groupby(reader, key=lambda row: (row.get("patient_id"), row.get("doctor_license"))):
+            yield _record_from_rows(list(rows))
+
+
+def validate_record(record):
+    missing = [f"patient {field}" for field in REQUIRED_PATIENT_FIELDS if not record['patient_info'][field]]
+    missing += [f"doctor {field}" for field in REQUIRED_DOCTOR_FIELDS if not record['doctor_info'][field]]
+    if not record['diagnosis']:
+        missing.append("diagnosis")
+    if missing:
+        return "missing " + ", ".join(missing)
+    if not record['medications']:
+        return "no medications"
+    return None
+
+
+# Worker process entry point: render one PDF and time it
+def render_record(index, record, prescription_id):
+    start = time.perf_counter()
+    try:
+        pdf_bytes = create_prescription(prescription_id=prescription_id, **record)
+        error = None
+    except Exception as e:
+        pdf_bytes, error = None, str(e)
+    return index, pdf_bytes, (time.perf_counter() - start) * 1000, error
+
+
+def _prescription_id(batch_id, index):
+    return f"RX-{batch_id}-{index + 1:05d}"
+
+
+def _file_name(index, record):
+    patient_id = re.sub(r"[^A-Za-z0-9_-]+", "_", record['patient_info']['id']) or "patient"
+    return f"{index + 1:05d}_{patient_id}.pdf"
+
+
+# Render every record into `zip_target` (a path or binary file object). Yields one timing
+# row per document as it completes, so callers can report progress incrementally
+def generate_zip(records, zip_target, workers=None, max_in_flight=None):
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * workers
+    batch_id = datetime.now().strftime('%Y%m%d%H%M%S')
+    # Spawned workers import only this module and fpdf, never the app or TensorFlow
+    context = multiprocessing.get_context("spawn")
+    with zipfile.ZipFile(zip_target, "w", zipfile.ZIP_DEFLATED) as archive, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        in_flight = {}
+
+        def drain(return_when):
+            done, _ = wait(in_flight, return_when=return_when)
+            for future in done:
+                record = in_flight.pop(future)
+                index, pdf_bytes, render_ms, error = future.result()
+                file_name = _file_name(index, record)
+                if pdf_bytes is not None:
+                    archive.writestr(file_name, pdf_bytes)
+                yield {
+                    "document": index + 1,
+                    "patient_id": record['patient_info']['id'],
+                    "doctor_license": record['doctor_info']['license'],
+                    "prescription_id": _prescription_id(batch_id, index),
+                    "diagnosis": record['diagnosis'],
+                    "file": file_name if pdf_bytes is not None else "",
+                    "medications": len(record['medications']),
+                    "render_ms": round(render_ms, 1),
+                    "error": error or ""
+                }
+
+        for index, record in enumerate(records):
+            error = validate_record(record)
+            if error:
+                yield {"document": index + 1, "patient_id": record['patient_info']['id'],
+                       "doctor_license": record['doctor_info']['license'], "prescription_id": "",
+                       "diagnosis": record['diagnosis'], "file": "",
+                       "medications": len(record['medications']), "render_ms": 0.0, "error": error}
+                continue
+            future = executor.submit(render_record, index, record, _prescription_id(batch_id, index))
+            in_flight[future] = record
+            if len(in_flight) >= max_in_flight:
+                yield from drain(FIRST_COMPLETED)
+        if in_flight:
+            yield from drain(ALL_COMPLETED)
+
+
+def detect_format(file_name):
+    return "jsonl" if file_name.lower().endswith((".jsonl", ".json")) else "csv"
+
+
+# Text stream over an uploaded or opened binary file
+def text_stream(binary):
+    return io.TextIOWrapper(binary, encoding="utf-8-sig", newline="")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render prescriptions in bulk into a ZIP of PDFs")
+    parser.add_argument("input", help="CSV or JSONL file of prescriptions")
+    parser.add_argument("--output", "-o", default="prescriptions.zip")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="input format (default: from the extension)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--report", help="write per-document timings as CSV")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    rows = []
+    with open(args.input, "rb") as f:
+        records = iter_records(text_stream(f), args.format or detect_format(args.input))
+        for row in generate_zip(records, args.output, workers=args.workers):
+            rows.append(row)
+            if row["error"]:
+                print(f"Document {row['document']} ({row['patient_id']}): {row['error']}", file=sys.stderr)
+    elapsed = time.perf_counter() - start
+
+    if args.report:
+        with open(args.report, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["document", "patient_id", "doctor_license", "prescription_id",
+                                                   "diagnosis", "file", "medications", "render_ms", "error"])
+            writer.writeheader()
+            writer.writerows(sorted(rows, key=lambda row: row["document"]))
+    rendered = [row for row in rows if not row["error"]]
+    mean_ms = sum(row["render_ms"] for row in rendered) / max(len(rendered), 1)
+    print(f"{len(rendered)} of {len(rows)} prescriptions written to {args.output} in {elapsed:.1f}s "
+          f"(mean render {mean_ms:.0f} ms)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+# Confidence-gated cascade: a fast model scores every film and only films whose score
+# falls within `band` of the 0.5 decision threshold are re-scored by a slower model.
+# Pick the band offline to hit a target sensitivity at the lowest expected compute:
+#   python cascade.py --validation-dir data/validation --target-sensitivity 0.95
+# where data/validation holds fractured/ and normal/ subfolders, or from saved scores:
+#   python cascade.py --scores cascade_scores.csv --target-sensitivity 0.95
+import argparse
+import csv
+import os
+import sys
+import time
+
+import numpy as np
+
+THRESHOLD = 0.5
+FAST_MODEL = "MobileNet (Keras)"
+ESCALATION_MODELS = ["EfficientNetB3 (Keras)", "DenseNet169 (Keras)"]
+DEFAULT_BAND = float(os.environ.get("BONESCAN_CASCADE_BAND", "0.15"))
+
+
+# True when a fast-stage score is too close to the threshold to trust
+def needs_escalation(probability, band):
+    return abs(probability - THRESHOLD) < band
+
+
+# Final scores and escalation mask for whole validation arrays
+def cascade_scores(fast, slow, band):
+    escalated = np.abs(fast - THRESHOLD) < band
+    return np.where(escalated, slow, fast), escalated
+
+
+# Sweep uncertainty bands and return the cheapest one meeting the target sensitivity.
+# Costs are per-image compute for each stage (e.g. milliseconds); if no band meets the
+# target, the most sensitive band is returned with "meets_target" False
+def choose_band(labels, fast, slow, target_sensitivity, fast_cost=1.0, slow_cost=4.0, step=0.005):
+    labels = np.asarray(labels).astype(bool)
+    fast = np.asarray(fast, dtype=np.float32)
+    slow = np.asarray(slow, dtype=np.float32)
+    positives = max(int(labels.sum()), 1)
+    negatives = max(int((~labels).sum()), 1)
+    candidates = []
+    for band in np.arange(0.0, THRESHOLD + step / 2, step):
+        final, escalated = cascade_scores(fast, slow, band)
+        predicted = final > THRESHOLD
+        candidates.append({
+            "band": round(float(band), 4),
+            "sensitivity": float(np.sum(predicted & labels)) / positives,
+            "specificity": float(np.sum(~predicted & ~labels)) / negatives,
+            "escalation_rate": float(escalated.mean()),
+            "expected_cost": fast_cost + float(escalated.mean()) * slow_cost
+        })
+    meeting = [c for c in candidates if c["sensitivity"] >= target_sensitivity]
+    if meeting:
+        best = min(meeting, key=lambda c: (c["expected_cost"], -c["specificity"]))
+        return dict(best, meets_target=True)
+    best = max(candidates, key=lambda c: (c["sensitivity"], -c["expected_cost"]))
+    return dict(best, meets_target=False)
+
+
+class _CollectingWriter:
+    def __init__(self):
+        self.rows = []
+
+    def write(self, row):
+        self.rows.append(row)
+
+    def flush(self):
+        pass
+
+
+# Score a labelled validation folder with one model; returns {path: probability} and ms per image
+def _score_folder(validation_dir, model_name):
+    from batch_score import iter_image_paths, score
+    from inference import load_named_model
+
+    model = load_named_model(model_name)
+    writer = _CollectingWriter()
+    start = time.perf_counter()
+    counts = score(iter_image_paths(validation_dir), model, model_name, writer, progress_every=0)
+    cost_ms = (time.perf_counter() - start) * 1000 / max(counts["scored"], 1)
+    return {row["path"]: row["fracture_probability"] for row in writer.rows if not row["error"]}, cost_ms
+
+
+def _label_for(path, validation_dir):
+    folder = os.path.relpath(path, validation_dir).split(os.sep)[0].lower()
+    return int(folder.startswith("fracture"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Choose the cascade uncertainty band for a target sensitivity")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--scores", help="CSV with label, fast and slow columns")
+    source.add_argument("--validation-dir", help="folder with fractured/ and normal/ subfolders")
+    parser.add_argument("--slow-model", default=ESCALATION_MODELS[0], choices=ESCALATION_MODELS)
+    parser.add_argument("--target-sensitivity", type=float, default=0.95)
+    parser.add_argument("--fast-cost", type=float, help="per-image cost of the fast stage (default: measured, or 1)")
+    parser.add_argument("--slow-cost", type=float, help="per-image cost of the slow stage (default: measured, or 4)")
+    parser.add_argument("--save-scores", help="write the validation scores as CSV for later runs")
+    args = parser.parse_args(argv)
+
+    fast_cost, slow_cost = 1.0, 4.0
+    if args.scores:
+        with open(args.scores, newline="") as f:
+            rows = list(csv.DictReader(f))
+        labels = [int(row["label"]) for row in rows]
+        fast = [float(row["fast"]) for row in rows]
+        slow = [float(row["slow"]) for row in rows]
+    else:
+        fast_scores, fast_cost = _score_folder(args.validation_dir, FAST_MODEL)
+        slow_scores, slow_cost = _score_folder(args.validation_dir, args.slow_model)
+        paths = [path for path in fast_scores if path in slow_scores]
+        labels = [_label_for(path, args.validation_dir) for path in paths]
+        fast = [fast_scores[path] for path in paths]
+        slow = [slow_scores[path] for path in paths]
+        if args.save_scores:
+            with open(args.save_scores, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["path", "label", "fast", "slow"])
+                writer.writerows(zip(paths, labels, fast, slow))
+    if not labels:
+        print("No scored validation images", file=sys.stderr)
+        return 1
+
+    choice = choose_band(
+        labels, fast, slow, args.target_sensitivity,
+        fast_cost=args.fast_cost or fast_cost, slow_cost=args.slow_cost or slow_cost
+    )
+    for name, value in choice.items():
+        print(f"{name}: {value}")
+    if not choice["meets_target"]:
+        print(f"Warning: no band reaches sensitivity {args.target_sensitivity}", file=sys.stderr)
+    print(f"Set BONESCAN_CASCADE_BAND={choice['band']} to use it in the app")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,332 @@
+# TensorFlow CPU tuning. TF sizes its intra-/inter-op thread pools to every core by
+# default, so several sessions predicting at once oversubscribe the machine. This
+# benchmarks the models across thread-pool sizes, batch sizes and precisions (float32
+# with oneDNN off or on, plus oneDNN bfloat16 auto-mixed-precision on CPUs with bf16
+# instructions) under concurrent callers. It saves the best configuration for this
+# machine, which load_tensorflow_model and the TFLite backend apply before TensorFlow is
+# imported (the configuration is read once per process). Thread pools
+# and oneDNN are fixed once TF starts, so every thread/precision combination runs in a
+# fresh interpreter. Results are keyed by CPU model and core count, so nodes of different
+# types can share one tuning file.
+#   python cpu_tuning.py --concurrency 2 --output tuning_report.json
+#   python cpu_tuning.py --models "MobileNet (Keras)" --intra 2 4 --inter 1 --max-latency-ms 250
+import argparse
+import functools
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import warnings
+from datetime import datetime
+from itertools import product
+
+import numpy as np
+
+ENABLED = os.environ.get("BONESCAN_CPU_TUNING", "1") != "0"
+TUNING_FILE = os.environ.get("BONESCAN_CPU_TUNING_FILE", "models/cpu_tuning.json")
+
+# Precision option -> (oneDNN enabled, bfloat16 auto-mixed-precision)
+PRECISIONS = {
+    "float32": (False, False),
+    "onednn-float32": (True, False),
+    "onednn-bfloat16": (True, True)
+}
+# bfloat16 results further than this from float32 on the check batch are not eligible
+MAX_ABS_DIFF = 0.05
+
+_CHILD = """
+import json, sys
+from cpu_tuning import run_trial
+print(json.dumps(run_trial(**json.loads(sys.argv[1]))))
+"""
+
+_lock = threading.Lock()
+_applied = False
+
+
+# CPU model, usable cores and bf16 support of this machine (read once per process)
+@functools.lru_cache(maxsize=None)
+def cpu_info():
+    cpu, flags = platform.processor() or platform.machine(), set()
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                key = key.strip()
+                if key == "model name":
+                    cpu = value.strip()
+                elif key in ("flags", "Features"):
+                    flags = set(value.split())
+                    break
+    except OSError:
+        pass
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    return {"cpu": cpu, "cpus": cpus, "bfloat16": bool(flags & {"avx512_bf16", "amx_bf16"})}
+
+
+def machine_fingerprint(info=None):
+    info = info or cpu_info()
+    return f"{info['cpu']} x{info['cpus']}"
+
+
+def _bfloat16_option(tf):
+    major, minor = (int(part) for part in tf.__version__.split(".")[:2])
+    return "auto_mixed_precision_onednn_bfloat16" if (major, minor) >= (2, 9) else "auto_mixed_precision_mkl"
+
+
+# Apply {"intra_op_threads", "inter_op_threads", "precision"} to this process. Thread
+# counts of 0 keep TensorFlow's defaults. Settings that TF no longer accepts, because
+# something already imported or initialised it, are skipped with a warning
+def configure_tensorflow(config):
+    global _applied
+    _applied = True
+    onednn, bfloat16 = PRECISIONS[config["precision"]]
+    onednn_opts = "1" if onednn else "0"
+    if "tensorflow" not in sys.modules:
+        os.environ["TF_ENABLE_ONEDNN_OPTS"] = onednn_opts
+    elif os.environ.get("TF_ENABLE_ONEDNN_OPTS") != onednn_opts:
+        warnings.warn(f"TensorFlow was imported before the CPU tuning was applied; "
+                      f"TF_ENABLE_ONEDNN_OPTS={onednn_opts} ({config['precision']}) was skipped")
+    import tensorflow as tf
+
+    try:
+        if config["intra_op_threads"]:
+            tf.config.threading.set_intra_op_parallelism_threads(config["intra_op_threads"])
+        if config["inter_op_threads"]:
+            tf.config.threading.set_inter_op_parallelism_threads(config["inter_op_threads"])
+    except RuntimeError:
+        warnings.warn("TensorFlow was initialised before the CPU tuning was applied; "
+                      "the tuned thread-pool sizes were skipped")
+    if bfloat16:
+        tf.config.optimizer.set_experimental_options({_bfloat16_option(tf): True})
+
+
+def _load_tuning(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"machines": {}}
+
+
+# Saved tuning entry for this machine, or None. Read once per process, like the
+# configuration apply_tuned_config applies, so sidebar reruns never touch the disk
+@functools.lru_cache(maxsize=None)
+def tuned_config(path=TUNING_FILE):
+    return _load_tuning(path).get("machines", {}).get(machine_fingerprint())
+
+
+# Called before each model load; only the first call in a process does anything, so a
+# tuning file written while the app runs takes effect on its next start
+def apply_tuned_config(path=TUNING_FILE):
+    global _applied
+    with _lock:
+        if _applied or not ENABLED:
+            return
+        entry = tuned_config(path)
+        if entry is None:
+            _applied = True
+            return
+        configure_tensorflow(entry["config"])
+
+
+def tuned_batch_size(model_name, default, path=TUNING_FILE):
+    entry = tuned_config(path) if ENABLED else None
+    return entry["batch_sizes"].get(model_name, default) if entry else default
+
+
+# Child side of one trial: configure TF, load the model and time predict_on_batch from
+# `concurrency` threads at once for each batch size. Scores on a fixed batch are returned
+# so the parent can check reduced-precision results against float32
+def run_trial(model_name, config, batch_sizes, concurrency, iterations):
+    configure_tensorflow(config)
+    from inference import load_named_model, model_input_size
+
+    model = load_named_model(model_name)
+    width, height = model_input_size(model)
+    rng = np.random.default_rng(0)
+    check_batch = rng.random((8, height, width, 3), dtype=np.float32)
+    check_scores = np.asarray(model.predict_on_batch(check_batch))[:, 0]
+
+    rows = []
+    for batch_size in batch_sizes:
+        batch = rng.random((batch_size, height, width, 3), dtype=np.float32)
+        model.predict_on_batch(batch)
+        latencies = []
+
+        def caller():
+            for _ in range(iterations):
+                start = time.perf_counter()
+                model.predict_on_batch(batch)
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        threads = [threading.Thread(target=caller) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - start
+        rows.append({
+            "batch_size": batch_size,
+            "throughput_per_s": round(batch_size * len(latencies) / wall, 1),
+            "latency_p50_ms": round(float(np.percentile(latencies, 50)), 1),
+            "latency_p95_ms": round(float(np.percentile(latencies, 95)), 1)
+        })
+    return {"rows": rows, "check_scores": check_scores.tolist()}
+
+
+def _run_child(model_name, config, batch_sizes, concurrency, iterations):
+    result = subprocess.run(
+        [sys.executable, "-c", _CHILD, json.dumps({
+            "model_name": model_name, "config": config, "batch_sizes": batch_sizes,
+            "concurrency": concurrency, "iterations": iterations
+        })],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "trial failed")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _thread_grid(cpus, concurrency, intra=None, inter=None):
+    intra = intra or sorted({n for n in (1, 2, 4, max(1, cpus // concurrency), cpus) if n <= cpus})
+    inter = inter or [1, 2]
+    # (0, 0) is TensorFlow's default sizing, kept as the baseline
+    return [(0, 0)] + list(product(intra, inter))
+
+
+# Benchmark every model under every configuration. One row per (model, config, batch size)
+def benchmark(models, thread_grid, precisions, batch_sizes, concurrency, iterations, log=print):
+    report = []
+    for model_name in models:
+        reference = None
+        for precision, (intra, inter) in product(precisions, thread_grid):
+            config = {"intra_op_threads": intra, "inter_op_threads": inter, "precision": precision}
+            log(f"{model_name}: intra={intra} inter={inter} {precision}")
+            try:
+                trial = _run_child(model_name, config, batch_sizes, concurrency, iterations)
+            except RuntimeError as e:
+                log(f"  skipped: {e}")
+                continue
+            scores = np.asarray(trial["check_scores"])
+            if reference is None and not PRECISIONS[precision][1]:
+                reference = scores
+            # Without a float32 reference, reduced precision cannot be checked and is never chosen
+            max_abs_diff = float(np.max(np.abs(scores - reference))) if reference is not None else 1.0
+            for row in trial["rows"]:
+                report.append(dict(row, model=model_name, max_abs_diff=round(max_abs_diff, 4), **config))
+    return report
+
+
+def _config_key(row):
+    return row["intra_op_threads"], row["inter_op_threads"], row["precision"]
+
+
+# Pick the one process-wide configuration with the best geometric-mean throughput across
+# models, counting only rows within `max_latency_ms` (p95) and MAX_ABS_DIFF of float32,
+# and the highest-throughput batch size for each model under it
+def choose_config(report, max_latency_ms=None, max_abs_diff=MAX_ABS_DIFF):
+    eligible = [
+        row for row in report
+        if row["max_abs_diff"] <= max_abs_diff and (max_latency_ms is None or row["latency_p95_ms"] <= max_latency_ms)
+    ]
+    models = {row["model"] for row in report}
+    best = {}
+    for row in eligible:
+        per_model = best.setdefault(_config_key(row), {})
+        current = per_model.get(row["model"])
+        if current is None or row["throughput_per_s"] > current["throughput_per_s"]:
+            per_model[row["model"]] = row
+    scored = [
+        (float(np.exp(np.mean([np.log(row["throughput_per_s"]) for row in per_model.values()]))), key, per_model)
+        for key, per_model in best.items() if set(per_model) == models
+    ]
+    if not scored:
+        return None
+    score, (intra, inter, precision), per_model = max(scored, key=lambda item: item[0])
+    return {
+        "config": {"intra_op_threads": intra, "inter_op_threads": inter, "precision": precision},
+        "batch_sizes": {model: row["batch_size"] for model, row in per_model.items()},
+        "score": round(score, 1)
+    }
+
+
+# Rows no other row of the same model and batch size beats on both throughput and p95 latency
+def mark_pareto(report):
+    for row in report:
+        row["pareto"] = not any(
+            other["model"] == row["model"] and other["batch_size"] == row["batch_size"]
+            and other["throughput_per_s"] >= row["throughput_per_s"]
+            and other["latency_p95_ms"] <= row["latency_p95_ms"]
+            and (other["throughput_per_s"], other["latency_p95_ms"]) != (row["throughput_per_s"], row["latency_p95_ms"])
+            for other in report
+        )
+    return report
+
+
+def save_tuning(choice, info, concurrency, path=TUNING_FILE):
+    tuning = _load_tuning(path)
+    tuning.setdefault("machines", {})[machine_fingerprint(info)] = dict(
+        choice, machine=info, concurrency=concurrency,
+        tuned_at=datetime.now().isoformat(sep=" ", timespec="seconds")
+    )
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(tuning, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def main(argv=None):
+    from inference import model_ids
+
+    info = cpu_info()
+    precisions = [name for name in PRECISIONS if info["bfloat16"] or not PRECISIONS[name][1]]
+    parser = argparse.ArgumentParser(description="Tune TensorFlow CPU threading and precision for this machine")
+    parser.add_argument("--models", nargs="+", default=list(model_ids), choices=list(model_ids))
+    parser.add_argument("--concurrency", type=int, default=2, help="simultaneous predict callers (sessions)")
+    parser.add_argument("--intra", nargs="+", type=int, help="intra-op pool sizes (default: derived from cores)")
+    parser.add_argument("--inter", nargs="+", type=int, help="inter-op pool sizes (default: 1 2)")
+    parser.add_argument("--precisions", nargs="+", default=precisions, choices=precisions)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 4, 16, 32])
+    parser.add_argument("--iterations", type=int, default=10, help="predict calls per caller per batch size")
+    parser.add_argument("--max-latency-ms", type=float, help="only pick configurations within this p95 latency")
+    parser.add_argument("--tuning-file", default=TUNING_FILE)
+    parser.add_argument("--output", help="write the full report as JSON")
+    parser.add_argument("--dry-run", action="store_true", help="report without saving the chosen configuration")
+    args = parser.parse_args(argv)
+
+    print(f"{machine_fingerprint(info)} (bfloat16: {'yes' if info['bfloat16'] else 'no'})", file=sys.stderr)
+    grid = _thread_grid(info["cpus"], args.concurrency, args.intra, args.inter)
+    report = mark_pareto(benchmark(
+        args.models, grid, args.precisions, args.batch_sizes, args.concurrency, args.iterations,
+        log=lambda message: print(message, file=sys.stderr)
+    ))
+
+    columns = ["model", "precision", "intra_op_threads", "inter_op_threads", "batch_size",
+               "throughput_per_s", "latency_p50_ms", "latency_p95_ms", "max_abs_diff", "pareto"]
+    print("\t".join(columns))
+    for row in sorted(report, key=lambda row: (row["model"], row["batch_size"], row["latency_p95_ms"])):
+        print("\t".join(str(row[column]) for column in columns))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    choice = choose_config(report, args.max_latency_ms)
+    if choice is None:
+        print("No configuration met the latency and accuracy limits for every model", file=sys.stderr)
+        return 1
+    print(f"Best: {choice['config']} batch sizes {choice['batch_sizes']} "
+          f"({choice['score']} images/s geometric mean)", file=sys.stderr)
+    if not args.dry_run:
+        save_tuning(choice, info, args.concurrency, args.tuning_file)
+        print(f"Saved to {args.tuning_file}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+# Parallel multi-model ensemble: every member scores the same film on its own thread, at
+# its own input size, so total latency tracks the slowest member
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from inference import model_ids, grayscale_plane, model_input_size
+
+COMBINE_METHODS = ["mean", "max", "weighted vote"]
+
+_executor = ThreadPoolExecutor(max_workers=len(model_ids), thread_name_prefix="ensemble")
+
+
+# Combine member fracture probabilities into one ensemble score in [0, 1]
+def combine(probabilities, method, weights=None):
+    probabilities = np.asarray(probabilities, dtype=np.float32)
+    weights = np.ones_like(probabilities) if weights is None else np.asarray(weights, dtype=np.float32)
+    if method == "mean":
+        return float(probabilities.mean())
+    if method == "max":
+        return float(probabilities.max())
+    if method == "weighted vote":
+        # Share of the total weight voting "fracture"
+        return float(np.sum(weights * (probabilities > 0.5)) / max(float(np.sum(weights)), 1e-9))
+    raise ValueError(f"Unknown combine method: {method}")
+
+
+# Score a film with each model key concurrently; decode(size) returns the film decoded for
+# that input size, exactly as the single-model path decodes it, so members score the same
+# tensor they would alone. Returns [(key, probability, latency_ms)] in member order and the
+# total wall time in ms
+def run_ensemble(decode, member_keys, registry):
+    planes = {}
+    planes_lock = threading.Lock()
+
+    # InceptionV3 takes 299x299 and the others 224x224, so decode once per distinct size
+    def plane_for(size):
+        with planes_lock:
+            if size not in planes:
+                planes[size] = grayscale_plane(decode(size), size)
+            return planes[size]
+
+    def score_member(key):
+        start = time.perf_counter()
+        with registry.acquire(key) as model:
+            width, height = model_input_size(model)
+            plane = plane_for((width, height))
+            batch = np.broadcast_to(plane[None, :, :, None], (1, height, width, 3))
+            probability = float(np.asarray(model.predict_on_batch(batch))[0, 0])
+        return key, probability, (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    results = list(_executor.map(score_member, member_keys))
+    return results, (time.perf_counter() - start) * 1000
@@ -0,0 +1,109 @@
+# Grad-CAM explanations. The fracture score and the gradients of that score with respect
+# to the last convolutional feature map come from a single forward/backward pass, so an
+# explained analysis needs no separate predict call. The gradient function for each
+# loaded model is built once and kept next to it in a WeakKeyDictionary, so it is freed
+# together with the model when the registry evicts it. TFLite models have no gradients
+import threading
+import weakref
+
+import numpy as np
+from PIL import Image
+
+from inference import display_image
+
+# Display width of the rendered overlay
+OVERLAY_WIDTH = 640
+
+_x = np.linspace(0.0, 1.0, 256, dtype=np.float32)
+# 256-entry jet colormap as float32 RGB in [0, 255]
+JET = np.stack([
+    np.clip(1.5 - np.abs(4 * _x - 3), 0, 1),
+    np.clip(1.5 - np.abs(4 * _x - 2), 0, 1),
+    np.clip(1.5 - np.abs(4 * _x - 1), 0, 1)
+], axis=1) * 255
+
+_explainers = weakref.WeakKeyDictionary()
+_explainers_lock = threading.Lock()
+
+
+# The last layer with a 4-D (batch, height, width, channels) output
+def _last_feature_layer(model):
+    for layer in reversed(model.layers):
+        shape = getattr(layer, "output_shape", None) or tuple(getattr(layer.output, "shape", ()))
+        if len(shape) == 4:
+            return layer
+    raise ValueError(f"{getattr(model, 'name', 'model')} has no convolutional feature map")
+
+
+def _build_explainer(model):
+    import tensorflow as tf
+
+    feature_layer = _last_feature_layer(model)
+    # The explainer is the model's WeakKeyDictionary value, so it may only reach the model
+    # through a weak reference; a strong one would keep its own key (and weights) alive
+    model_ref = weakref.ref(model)
+    if isinstance(model, tf.keras.Sequential) or isinstance(feature_layer, tf.keras.Model):
+        # A pretrained base nested in the head: the base's own .output belongs to its inner
+        # graph, so replay the top-level layers (a chain) and keep the base's output
+        def forward(batch):
+            x = batch
+            features = None
+            for layer in model_ref().layers:
+                if isinstance(layer, tf.keras.layers.InputLayer):
+                    continue
+                x = layer(x, training=False)
+                if layer is feature_layer:
+                    features = x
+            return features, x
+    else:
+        # Built from the model's layers, not the model object, so it holds no reference to it
+        forward_model = tf.keras.Model(model.inputs, [feature_layer.output, model.output])
+
+        def forward(batch):
+            return forward_model(batch, training=False)
+
+    @tf.function(reduce_retracing=True)
+    def explain(batch):
+        with tf.GradientTape() as tape:
+            features, predictions = forward(batch)
+            score = predictions[:, 0]
+        grads = tape.gradient(score, features)
+        channel_weights = tf.reduce_mean(grads, axis=(1, 2), keepdims=True)
+        cams = tf.nn.relu(tf.reduce_sum(channel_weights * features, axis=-1))
+        return score, cams
+
+    return explain
+
+
+def _explainer_for(model):
+    with _explainers_lock:
+        explainer = _explainers.get(model)
+        if explainer is None:
+            explainer = _explainers[model] = _build_explainer(model)
+        return explainer
+
+
+# Fracture probability and a coarse (h, w) float32 heatmap in [0, 1] for a (1, H, W, 3) batch
+def gradcam(model, batch):
+    if not hasattr(model, "layers"):
+        raise ValueError("Grad-CAM needs a Keras model; TFLite backends have no gradients")
+    score, cams = _explainer_for(model)(np.ascontiguousarray(batch, dtype=np.float32))
+    heatmap = np.asarray(cams)[0].astype(np.float32)
+    peak = float(heatmap.max())
+    if peak > 0:
+        heatmap /= peak
+    return float(np.asarray(score)[0]), heatmap
+
+
+# Blend a heatmap over a grayscale film at display resolution; returns an (h, w, 3) uint8 array.
+# The colour is weighted by heat, so cold regions keep the original film
+def overlay_heatmap(image, heatmap, width=OVERLAY_WIDTH, alpha=0.5):
+    image = display_image(image)
+    if image.width > width:
+        image = image.resize((width, max(1, round(image.height * width / image.width))))
+    base = np.asarray(image, dtype=np.float32)[:, :, None]
+    heat = np.asarray(
+        Image.fromarray(np.uint8(np.clip(heatmap, 0, 1) * 255)).resize(image.size, Image.BILINEAR)
+    )
+    weight = (alpha / 255) * heat[:, :, None].astype(np.float32)
+    return np.uint8(base * (1 - weight) + JET[heat] * weight)
@@ -0,0 +1,250 @@
+# Local audit history of analyses and prescriptions in SQLite (WAL mode, so the history
+# panel reads while the writer appends). UI code never touches the disk: record_*()
+# only enqueue a row, and one background thread drains the queue and writes whatever
+# has accumulated in a single transaction. An analysis is recorded once; identifiers
+# filled in afterwards update its row through the token record_analysis() returns. Each table is indexed by patient and by
+# date; SQLite appends the rowid to every index, so "newest first for this patient"
+# is an index range scan. page() paginates by keyset (id < last seen id) rather than
+# OFFSET, and turns date bounds into id bounds (rows are written in time order by the one
+# writer), so every page is a range scan in id order however deep into the history it is
+import atexit
+import itertools
+import json
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    patient_id TEXT,
+    doctor_license TEXT,
+    image_hash TEXT NOT NULL,
+    model TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    confidence REAL,
+    timings TEXT
+);
+CREATE INDEX IF NOT EXISTS analyses_patient ON analyses (patient_id);
+CREATE INDEX IF NOT EXISTS analyses_created ON analyses (created_at);
+CREATE TABLE IF NOT EXISTS prescriptions (
+    id INTEGER PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    patient_id TEXT,
+    doctor_license TEXT,
+    prescription_id TEXT,
+    diagnosis TEXT,
+    medications INTEGER,
+    source TEXT NOT NULL,
+    timings TEXT
+);
+CREATE INDEX IF NOT EXISTS prescriptions_patient ON prescriptions (patient_id);
+CREATE INDEX IF NOT EXISTS prescriptions_doctor ON prescriptions (doctor_license);
+CREATE INDEX IF NOT EXISTS prescriptions_created ON prescriptions (created_at);
+"""
+
+COLUMNS = {
+    "analyses": ("created_at", "patient_id", "doctor_license", "image_hash", "model", "mode",
+                 "confidence", "timings"),
+    "prescriptions": ("created_at", "patient_id", "doctor_license", "prescription_id", "diagnosis",
+                      "medications", "source", "timings")
+}
+FILTERS = {"analyses": ("patient_id",), "prescriptions": ("patient_id", "doctor_license")}
+# Row ids of recent analyses by token, for update_analysis(); older tokens are forgotten
+MAX_TOKENS = 4096
+
+_STOP = object()
+
+
+def _now():
+    return datetime.now().isoformat(sep=" ", timespec="seconds")
+
+
+# {stage: seconds} as from metrics.trace(), stored as JSON milliseconds
+def _timings_json(timings):
+    if not timings:
+        return None
+    return json.dumps({stage: round(seconds * 1000, 1) for stage, seconds in timings.items()})
+
+
+class HistoryStore:
+    def __init__(self, path, max_queue=10000, batch_size=500):
+        self.path = path
+        self.batch_size = batch_size
+        self._queue = queue.Queue(max_queue)
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = {"written": 0, "dropped": 0, "failed": 0}
+        self._tokens = itertools.count(1)
+        # Only touched by the writer thread
+        self._row_ids = OrderedDict()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+        self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL only risks the last transactions on power loss, never corruption
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    # One reader connection per thread (Streamlit runs each session in its own threads)
+    def _reader(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self._stats[name] += n
+
+    # Queue ("insert" | "update", table, values, token)
+    def _enqueue(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            # Never block the UI on a stalled disk; the loss is visible in stats()
+            self._count("dropped")
+
+    # Returns a token for update_analysis()
+    def record_analysis(self, image_hash, model, mode, confidence, timings=None, patient_id=None,
+                        doctor_license=None):
+        token = next(self._tokens)
+        self._enqueue(("insert", "analyses", (
+            _now(), patient_id or None, doctor_license or None, image_hash, model, mode,
+            None if confidence is None else float(confidence), _timings_json(timings)
+        ), token))
+        return token
+
+    # Set the patient ID and doctor licence of an analysis recorded earlier in this process
+    def update_analysis(self, token, patient_id=None, doctor_license=None):
+        self._enqueue(("update", "analyses", (patient_id or None, doctor_license or None), token))
+
+    def record_prescription(self, patient_id, doctor_license, prescription_id, diagnosis, medications,
+                            source="form", timings=None):
+        self._enqueue(("insert", "prescriptions", (
+            _now(), patient_id or None, doctor_license or None, prescription_id, diagnosis,
+            medications, source, _timings_json(timings)
+        ), None))
+
+    def _write(self, conn, batch):
+        row_ids = {}
+        try:
+            with conn:
+                for op, table, values, token in batch:
+                    if op == "update":
+                        row_id = row_ids.get(token) or self._row_ids.get(token)
+                        if row_id is not None:
+                            conn.execute(
+                                f"UPDATE {table} SET patient_id = ?, doctor_license = ? WHERE id = ?",
+                                values + (row_id,)
+                            )
+                        continue
+                    columns = COLUMNS[table]
+                    cursor = conn.execute(
+                        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                        values
+                    )
+                    if token is not None:
+                        row_ids[token] = cursor.lastrowid
+            self._count("written", len(batch))
+        except sqlite3.Error:
+            self._count("failed", len(batch))
+            return
+        self._row_ids.update(row_ids)
+        while len(self._row_ids) > MAX_TOKENS:
+            self._row_ids.popitem(last=False)
+
+    def _write_loop(self):
+        conn = self._connect()
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            # Everything that queued up during the last write goes into one transaction
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if _STOP in batch:
+                stopping = True
+            rows = [item for item in batch if item is not _STOP]
+            if rows:
+                self._write(conn, rows)
+            for _ in batch:
+                self._queue.task_done()
+        conn.close()
+
+    # Wait until every queued row has been written, or at most `timeout` seconds.
+    # Returns whether the queue was drained
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self):
+        if self._writer.is_alive():
+            self._queue.put(_STOP)
+            self._writer.join()
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats, queued=self._queue.qsize())
+
+    # Lowest id written at or after `created_at`, by one seek on the date index, or None
+    def _first_id_from(self, table, created_at):
+        row = self._reader().execute(
+            f"SELECT id FROM {table} WHERE created_at >= ? ORDER BY created_at, id LIMIT 1", (created_at,)
+        ).fetchone()
+        return row[0] if row else None
+
+    # One page of `table`, newest first. `filters` match columns exactly (patient_id, and
+    # doctor_license for prescriptions); `since`/`until` are dates, both inclusive. Pass the
+    # returned cursor as `before` for the next page; it is None on the last page
+    def page(self, table, filters=None, since=None, until=None, before=None, limit=25):
+        clauses, params = [], []
+        for column, value in (filters or {}).items():
+            if column not in FILTERS[table]:
+                raise ValueError(f"Cannot filter {table} by {column}")
+            if value:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since:
+            first_id = self._first_id_from(table, since.isoformat())
+            if first_id is None:
+                return [], None
+            clauses.append("id >= ?")
+            params.append(first_id)
+        if until:
+            end_id = self._first_id_from(table, (until + timedelta(days=1)).isoformat())
+            if end_id is not None:
+                clauses.append("id < ?")
+                params.append(end_id)
+        if before is not None:
+            clauses.append("id < ?")
+            params.append(before)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._reader().execute(
+            f"SELECT * FROM {table} {where} ORDER BY id DESC LIMIT ?", params + [limit + 1]
+        ).fetchall()
+        rows = [dict(row) for row in rows]
+        for row in rows:
+            if row["timings"]:
+                row["timings"] = json.loads(row["timings"])
+        if len(rows) > limit:
+            return rows[:limit], rows[limit - 1]["id"]
+        return rows, None
@@ -0,0 +1,134 @@
+# Streamlit-free inference core shared by the app and the command-line tools.
+# TensorFlow is imported on first model load, not at import time
+import numpy as np
+from PIL import Image
+import os
+from model_store import ensure_artifact
+from medical_images import HIGH_BIT_MODES, is_dicom, read_dicom, read_high_bit
+
+# Model mappings for fracture detection
+model_ids = {
+     "DenseNet169 (Keras)": "1dIhc-0vd9sDoU5O6H0ZE6RYrP-CAyWks",
+    "InceptionV3 (Keras)": "1ARBL_SK66Ppj7_kJ1Pe2FhH2olbTQHWY",
+    "MobileNet (Keras)": "14YuV3qZb_6FI7pXoiJx69HxiDD4uNc_Q",
+    "EfficientNetB3 (Keras)": "1cQA3_oH2XjDFK-ZE9D9YsP6Ya8fQiPOy"
+}
+
+def model_path_for(model_name):
+    return f"models/{model_name}.keras"
+
+# Import TensorFlow with the tuned CPU configuration and create its runtime (eager context,
+# CPU device and thread pools). Model memory is measured from after this point, so the
+# runtime is not charged to whichever model happens to load first
+def start_tensorflow():
+    from cpu_tuning import apply_tuned_config
+    apply_tuned_config()
+    import tensorflow as tf
+
+    tf.zeros((1,)).numpy()
+
+# Function to download and load fracture detection model
+def load_tensorflow_model(file_id, model_name):
+    # Thread pools and precision from cpu_tuning.py; must run before TensorFlow initialises
+    from cpu_tuning import apply_tuned_config
+    apply_tuned_config()
+    from tensorflow.keras.models import load_model
+
+    # Downloads are verified against models/manifest.json before the file is used
+    model_path = ensure_artifact(f"{model_name}.keras", file_id)
+    return load_model(model_path)
+
+# Load a model by its display name, e.g. "MobileNet (Keras)"
+def load_named_model(model_name):
+    return load_tensorflow_model(model_ids[model_name], model_name.replace(" ", "_"))
+
+# uint8 -> float32 lookup table; matches the old float64 x / 255.0 exactly once cast to float32
+UNIT_SCALE = (np.arange(256) / 255.0).astype(np.float32)
+
+# Model inputs are full decodes by default, so grayscale films give exactly the tensors the
+# original preprocessing gave (tests/test_preprocessing.py). BONESCAN_JPEG_DRAFT=1 uses PIL's
+# reduced-scale JPEG decoding for model inputs too: faster on large films, but it resamples
+# from a DCT-downscaled image, so tensors differ slightly (under 0.5 grey levels on average,
+# at most a few). Previews, overlays and perceptual hashes always pass draft=True
+JPEG_DRAFT = os.environ.get("BONESCAN_JPEG_DRAFT", "0") == "1"
+
+def model_input_size(model):
+    height, width = model.input_shape[1:3]
+    return width, height
+
+# Decode an uploaded file straight to grayscale. For JPEGs, draft() lets the decoder
+# downscale by up to 8x in the DCT domain while staying at least as large as `size`.
+# DICOM and 16-bit films come back as windowed float32 "F" images (see medical_images);
+# `frame` picks a frame of a multi-frame DICOM, defaulting to the source's dicom_frame
+def decode_grayscale(source, size=None, draft=JPEG_DRAFT, frame=None):
+    if is_dicom(source):
+        return read_dicom(source, size, getattr(source, "dicom_frame", 0) if frame is None else frame)
+    image = Image.open(source)
+    if image.mode in HIGH_BIT_MODES:
+        return read_high_bit(image, size)
+    if draft and size and image.format == "JPEG":
+        image.draft("L", size)
+    if image.mode == "L":
+        return image
+    gray = image.convert("L")
+    image.close()
+    return gray
+
+# Grayscale image -> (height, width) float32 plane in [0, 1] at the model's input size.
+# Converting to L before resizing resizes one channel instead of three; for grayscale
+# films (R == G == B) this is bit-identical to resizing in RGB first
+def grayscale_plane(image, size):
+    if image.mode == "F":
+        # Windowed high-bit-depth films are already float32 in [0, 1]
+        if image.size != size:
+            image = image.resize(size, Image.BILINEAR)
+        return np.asarray(image, dtype=np.float32)
+    if image.mode != "L":
+        image = image.convert("L")
+    if image.size != size:
+        image = image.resize(size)
+    return UNIT_SCALE[np.asarray(image)]
+
+# 8-bit grayscale version of a decoded film, for display
+def display_image(image):
+    if image.mode == "F":
+        return Image.fromarray(np.uint8(np.asarray(image, dtype=np.float32) * 255 + 0.5))
+    return image if image.mode == "L" else image.convert("L")
+
+# Preprocessing function for fracture detection. The three channels are a broadcast
+# view of a single plane, so no stacked or expanded copies are allocated
+def preprocess_image_tf(uploaded_image, model):
+    width, height = model_input_size(model)
+    plane = grayscale_plane(uploaded_image, (width, height))
+    return np.broadcast_to(plane[None, :, :, None], (1, height, width, 3))
+
+# Decode and preprocess uploaded files into one contiguous float32 batch tensor,
+# writing each plane into the preallocated batch through a broadcast assignment.
+# Returns the batch, the position in `uploaded_files` of each batch row (file names
+# need not be unique) and (name, message) for files that could not be read
+def preprocess_batch_tf(uploaded_files, model):
+    width, height = model_input_size(model)
+    batch = np.empty((len(uploaded_files), height, width, 3), dtype=np.float32)
+    positions, errors = [], []
+    for position, uploaded_file in enumerate(uploaded_files):
+        try:
+            image = decode_grayscale(uploaded_file, (width, height))
+            batch[len(positions)] = grayscale_plane(image, (width, height))[:, :, None]
+            positions.append(position)
+        except Exception as e:
+            errors.append((uploaded_file.name, str(e)))
+    return batch[:len(positions)], positions, errors
+
+# Score a batch with one forward pass per chunk of batch_size images
+def predict_batch(model, batch, batch_size=16):
+    scores = np.empty(len(batch), dtype=np.float32)
+    for start in range(0, len(batch), batch_size):
+        chunk = batch[start:start + batch_size]
+        scores[start:start + len(chunk)] = np.asarray(model.predict_on_batch(chunk))[:, 0]
+    return scores
+
+# Map a raw model output to a label and the confidence in that label
+def interpret_prediction(confidence):
+    result = "Fracture Detected" if confidence > 0.5 else "Normal"
+    confidence_score = confidence if result == "Fracture Detected" else 1 - confidence
+    return result, float(confidence_score) * 100
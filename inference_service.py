@@ -0,0 +1,391 @@
+# Standalone inference service. One process owns the models and coalesces requests from
+# every app session into shared forward passes: each (model, backend) key has a queue
+# that is drained into one batch once it holds --max-batch films or its oldest request
+# has waited --max-wait-ms. Serves a small HTTP API over TCP or a Unix socket:
+#   python inference_service.py --port 8502
+#   python inference_service.py --unix /tmp/bonescan.sock
+# The app sends films to it when BONESCAN_INFERENCE_URL is set, e.g.
+# http://127.0.0.1:8502 or unix:///tmp/bonescan.sock
+#   POST /predict?model=MobileNet+(Keras)&backend=keras[&frame=0]   body: image file bytes
+#   GET  /health
+import argparse
+import asyncio
+import http.client
+import io
+import json
+import os
+import socket
+import sys
+import time
+import urllib.parse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from inference import model_ids, model_input_size, decode_grayscale, grayscale_plane, start_tensorflow
+from model_preloader import warmup_model
+from model_registry import ModelRegistry
+from prediction_cache import file_checksum
+from tflite_backend import BACKENDS, artifact_path_for, load_model_for_backend
+
+INFERENCE_URL = os.environ.get("BONESCAN_INFERENCE_URL", "")
+INFERENCE_TIMEOUT = float(os.environ.get("BONESCAN_INFERENCE_TIMEOUT", "60"))
+MAX_BATCH = int(os.environ.get("BONESCAN_SERVICE_MAX_BATCH", "16"))
+MAX_WAIT_MS = float(os.environ.get("BONESCAN_SERVICE_MAX_WAIT_MS", "10"))
+# How long the client trusts the model checksums from /health before asking again
+CHECKSUM_TTL = float(os.environ.get("BONESCAN_INFERENCE_CHECKSUM_TTL", "30"))
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+def _decode_plane(data, size, frame=0):
+    return grayscale_plane(decode_grayscale(io.BytesIO(data), size, frame=frame), size)
+
+
+# Request queue and batching loop for one (model name, backend) key
+class _MicroBatcher:
+    def __init__(self, key, registry, predict_executor, max_batch, max_wait_ms):
+        self.key = key
+        self.registry = registry
+        self.predict_executor = predict_executor
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.size = None
+        self._loading = None
+        self.requests = 0
+        self.batches = 0
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    # The model's (width, height). The first call loads and warms the model; calls that arrive
+    # meanwhile wait for that same load instead of queueing loads of their own
+    async def input_size(self):
+        if self.size is None:
+            if self._loading is None:
+                self._loading = asyncio.get_running_loop().run_in_executor(self.predict_executor, self._load)
+            try:
+                self.size = await self._loading
+            except Exception:
+                # The next request tries again
+                self._loading = None
+                raise
+        return self.size
+
+    def _load(self):
+        with self.registry.acquire(self.key) as model:
+            warmup_model(model)
+            return model_input_size(model)
+
+    async def submit(self, plane):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((plane, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        items = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(items) < self.max_batch:
+            try:
+                items.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = await self._collect()
+            batch_start = time.perf_counter()
+            try:
+                scores, predict_ms = await loop.run_in_executor(
+                    self.predict_executor, self._predict, [plane for plane, _, _ in items]
+                )
+            except Exception as e:
+                for _, future, _ in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.requests += len(items)
+            self.batches += 1
+            for (_, future, queued), score in zip(items, scores):
+                if not future.done():
+                    future.set_result({
+                        "confidence": float(score),
+                        "batch_size": len(items),
+                        "queue_ms": round((batch_start - queued) * 1000, 1),
+                        "predict_ms": round(predict_ms, 1)
+                    })
+
+    # Runs on the predict thread: stack the planes into one batch and score it
+    def _predict(self, planes):
+        height, width = planes[0].shape
+        batch = np.empty((len(planes), height, width, 3), dtype=np.float32)
+        for i, plane in enumerate(planes):
+            batch[i] = plane[:, :, None]
+        start = time.perf_counter()
+        with self.registry.acquire(self.key) as model:
+            scores = np.asarray(model.predict_on_batch(batch))[:, 0]
+        return scores, (time.perf_counter() - start) * 1000
+
+
+class InferenceService:
+    def __init__(self, registry, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS, decode_workers=None):
+        self.registry = registry
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.decode_executor = ThreadPoolExecutor(
+            max_workers=decode_workers or os.cpu_count() or 1, thread_name_prefix="decode"
+        )
+        # Forward passes run one at a time so batches use TensorFlow's thread pools without contention
+        self.predict_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="predict")
+        self.batchers = {}
+
+    def batcher_for(self, key):
+        batcher = self.batchers.get(key)
+        if batcher is None:
+            batcher = self.batchers[key] = _MicroBatcher(
+                key, self.registry, self.predict_executor, self.max_batch, self.max_wait_ms
+            )
+        return batcher
+
+    async def preload(self, keys):
+        await asyncio.gather(*(self.batcher_for(key).input_size() for key in keys))
+
+    async def predict(self, data, key, frame=0):
+        batcher = self.batcher_for(key)
+        size = await batcher.input_size()
+        plane = await asyncio.get_running_loop().run_in_executor(
+            self.decode_executor, _decode_plane, data, size, frame
+        )
+        return await batcher.submit(plane)
+
+    # Clients version their cached predictions by these, since they have no model files
+    def _artifacts(self):
+        return [
+            {"model": [name, backend], "checksum": file_checksum(artifact_path_for(name, backend))}
+            for name in model_ids for backend in BACKENDS
+            if os.path.exists(artifact_path_for(name, backend))
+        ]
+
+    # Checksums are hashed off the event loop (a new model file takes a while; file_checksum
+    # memoizes known versions), so /health never stalls the requests being served
+    async def health(self):
+        artifacts = await asyncio.get_running_loop().run_in_executor(self.decode_executor, self._artifacts)
+        registry_stats = self.registry.stats()
+        return {
+            "artifacts": artifacts,
+            "registry": dict(registry_stats, models=[
+                dict(row, model=list(row["model"])) for row in registry_stats["models"]
+            ]),
+            "queues": [
+                {
+                    "model": list(key),
+                    "queued": batcher.queue.qsize(),
+                    "requests": batcher.requests,
+                    "batches": batcher.batches,
+                    "mean_batch_size": round(batcher.requests / max(batcher.batches, 1), 2)
+                }
+                for key, batcher in self.batchers.items()
+            ]
+        }
+
+    async def _route(self, method, target, body):
+        url = urllib.parse.urlsplit(target)
+        if method == "GET" and url.path == "/health":
+            return 200, await self.health()
+        if method != "POST" or url.path != "/predict":
+            return 404, {"error": f"No route for {method} {url.path}"}
+        query = urllib.parse.parse_qs(url.query)
+        key = (query.get("model", [""])[0], query.get("backend", ["keras"])[0])
+        if key[0] not in model_ids or key[1] not in BACKENDS:
+            return 400, {"error": f"Unknown model or backend: {key[0]} / {key[1]}"}
+        if not body:
+            return 400, {"error": "Empty image body"}
+        try:
+            frame = int(query.get("frame", ["0"])[0])
+        except ValueError:
+            return 400, {"error": "Frame must be an integer"}
+        try:
+            return 200, await self.predict(body, key, frame)
+        except Exception as e:
+            return 500, {"error": str(e)}
+
+    # Minimal HTTP/1.1 handler with keep-alive; one request at a time per connection
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", "0"))
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, {"error": "Image too large"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                status, payload = await self._route(method, target, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+# Thread-safe client used by the app; concurrent calls from many sessions are what
+# lets the service fill its batches
+class InferenceClient:
+    def __init__(self, url=INFERENCE_URL, timeout=INFERENCE_TIMEOUT, workers=16):
+        self.url = url
+        self.timeout = timeout
+        self._parsed = urllib.parse.urlsplit(url)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference-client")
+        self._checksums = {}
+        self._checksums_at = None
+        self._checksum_lock = threading.Lock()
+
+    def _connection(self):
+        if self._parsed.scheme == "unix":
+            return _UnixHTTPConnection(self._parsed.path, self.timeout)
+        return http.client.HTTPConnection(self._parsed.hostname, self._parsed.port or 80, timeout=self.timeout)
+
+    def _request(self, method, path, body=None):
+        connection = self._connection()
+        try:
+            connection.request(method, path, body=body, headers={
+                "Content-Type": "application/octet-stream",
+                "Connection": "close"
+            })
+            response = connection.getresponse()
+            payload = json.loads(response.read() or b"{}")
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise RuntimeError(f"Inference service error {response.status}: {payload.get('error', '')}")
+        return payload
+
+    # Fracture probability for one image file's bytes (`frame` selects a multi-frame DICOM frame)
+    def predict(self, data, model_key, frame=0):
+        query = urllib.parse.urlencode({"model": model_key[0], "backend": model_key[1], "frame": frame})
+        return self._request("POST", f"/predict?{query}", data)["confidence"]
+
+    # Send [(bytes, model key[, frame])] concurrently; returns [(probability, latency_ms)] in order.
+    # With return_exceptions, a failed request's entry is its exception instead of raising
+    def predict_many(self, requests, return_exceptions=False):
+        def timed(request):
+            start = time.perf_counter()
+            try:
+                confidence = self.predict(*request)
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                return e
+            return confidence, (time.perf_counter() - start) * 1000
+
+        return list(self._executor.map(timed, requests))
+
+    def health(self):
+        return self._request("GET", "/health")
+
+    # Checksum of the service's artifact for a model key, refreshed from /health at most once
+    # per CHECKSUM_TTL seconds; None when the service has no such file or cannot be reached
+    def model_checksum(self, model_key):
+        with self._checksum_lock:
+            if self._checksums_at is None or time.monotonic() - self._checksums_at > CHECKSUM_TTL:
+                try:
+                    artifacts = self.health().get("artifacts", [])
+                except (OSError, RuntimeError, ValueError):
+                    return None
+                self._checksums = {tuple(row["model"]): row["checksum"] for row in artifacts}
+                self._checksums_at = time.monotonic()
+            return self._checksums.get(tuple(model_key))
+
+
+async def serve(service, host, port, unix_path=None, preload=()):
+    if unix_path:
+        if os.path.exists(unix_path):
+            os.remove(unix_path)
+        server = await asyncio.start_unix_server(service.handle, path=unix_path)
+    else:
+        server = await asyncio.start_server(service.handle, host, port)
+    await service.preload(preload)
+    print(f"Serving on {unix_path or f'{host}:{port}'}", file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve fracture models with cross-session micro-batching")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument("--unix", help="listen on this Unix socket path instead of TCP")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS,
+                        help="longest a request waits for its batch to fill")
+    parser.add_argument("--decode-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--memory-mb", type=int, default=int(os.environ.get("BONESCAN_MODEL_MEMORY_MB", "1536")))
+    parser.add_argument("--backend", choices=BACKENDS, default="keras", help="backend for --preload")
+    parser.add_argument("--preload", nargs="*", default=[], choices=list(model_ids))
+    args = parser.parse_args(argv)
+
+    service = InferenceService(
+        ModelRegistry(
+            load_model_for_backend, budget_bytes=args.memory_mb * 1024 * 1024, runtime=start_tensorflow
+        ),
+        max_batch=args.max_batch,
+        max_wait_ms=args.max_wait_ms,
+        decode_workers=args.decode_workers
+    )
+    try:
+        asyncio.run(serve(
+            service, args.host, args.port, args.unix,
+            preload=[(model_name, args.backend) for model_name in args.preload]
+        ))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
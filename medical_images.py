@@ -0,0 +1,147 @@
+# DICOM and high-bit-depth (16-bit PNG/TIFF) film decoding. DICOM pixel data is read
+# lazily: for uncompressed transfer syntaxes the frames are a zero-copy view (np.memmap
+# for files on disk, np.frombuffer over uploaded bytes), and a strided subsample touches
+# only the rows needed for the requested size. Window/level maps the stored values to
+# float32 in [0, 1], returned as a PIL "F" image that inference.grayscale_plane accepts
+# alongside 8-bit "L" images. pydicom (in requirements.txt) is only imported for DICOM files
+import os
+
+import numpy as np
+from PIL import Image
+
+DICOM_EXTENSIONS = (".dcm", ".dicom")
+HIGH_BIT_MODES = ("I;16", "I;16B", "I;16L", "I", "F")
+# Percentiles used as the window when a film carries no window/level of its own
+AUTO_WINDOW = (0.5, 99.5)
+
+
+def _peek(source, size):
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return f.read(size)
+    position = source.tell()
+    source.seek(0)
+    header = source.read(size)
+    source.seek(position)
+    return header
+
+
+# True for files with a DICOM extension or the "DICM" preamble marker
+def is_dicom(source):
+    name = source if isinstance(source, (str, os.PathLike)) else getattr(source, "name", "")
+    if str(name).lower().endswith(DICOM_EXTENSIONS):
+        return True
+    return _peek(source, 132)[128:132] == b"DICM"
+
+
+def _import_pydicom():
+    try:
+        import pydicom
+    except ImportError:
+        raise ValueError("Reading DICOM files requires pydicom (pip install pydicom)") from None
+    return pydicom
+
+
+def _first(value):
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)) or type(value).__name__ == "MultiValue":
+        value = value[0] if len(value) else None
+    return None if value is None else float(value)
+
+
+# Every-nth-pixel view that stays at least as large as `size`, like JPEG draft decoding
+def _subsample(pixels, size):
+    if not size:
+        return pixels
+    step = max(1, min(pixels.shape[0] // size[1], pixels.shape[1] // size[0]))
+    return pixels[::step, ::step]
+
+
+# Rescale stored values and map the window [center - width/2, center + width/2] to [0, 1].
+# Without a window, the AUTO_WINDOW percentiles of a small subsample are used
+def window_level(pixels, center=None, width=None, slope=1.0, intercept=0.0, invert=False):
+    values = pixels.astype(np.float32)
+    if slope != 1.0 or intercept != 0.0:
+        values *= slope
+        values += intercept
+    if center is None or not width or width <= 0:
+        sample = values[::max(1, values.shape[0] // 256), ::max(1, values.shape[1] // 256)]
+        low, high = (float(v) for v in np.percentile(sample, AUTO_WINDOW))
+    else:
+        low, high = center - width / 2, center + width / 2
+    values -= low
+    values *= 1.0 / max(high - low, 1e-6)
+    np.clip(values, 0.0, 1.0, out=values)
+    if invert:
+        np.subtract(1.0, values, out=values)
+    return values
+
+
+# (frames, rows, columns) view of uncompressed pixel data without decoding it, or None
+# when the transfer syntax or layout needs pydicom's pixel handlers
+def _mapped_frames(ds, path, source, frames):
+    transfer_syntax = ds.file_meta.TransferSyntaxUID
+    if transfer_syntax.is_compressed or int(ds.get("SamplesPerPixel", 1)) != 1:
+        return None
+    bits = int(ds.get("BitsAllocated", 0))
+    offset = getattr(ds.get_item(0x7FE00010), "value_tell", None)
+    if bits not in (8, 16) or offset is None:
+        return None
+    kind = "u" if int(ds.get("PixelRepresentation", 0)) == 0 else "i"
+    dtype = np.dtype(f"{kind}{bits // 8}").newbyteorder("<" if transfer_syntax.is_little_endian else ">")
+    shape = (frames, int(ds.Rows), int(ds.Columns))
+    if path is not None:
+        return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+    buffer = source.getbuffer() if hasattr(source, "getbuffer") else source.getvalue()
+    return np.frombuffer(buffer, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+
+
+def _read_header(source, **kwargs):
+    pydicom = _import_pydicom()
+    if isinstance(source, (str, os.PathLike)):
+        return pydicom.dcmread(source, **kwargs)
+    source.seek(0)
+    return pydicom.dcmread(source, **kwargs)
+
+
+# DICOM attributes without the pixel data
+def dicom_header(source):
+    return _read_header(source, stop_before_pixels=True)
+
+
+def frame_count(source):
+    return int(dicom_header(source).get("NumberOfFrames", 1) or 1)
+
+
+# Decode one frame of a DICOM file to a windowed float32 "F" image, subsampled towards `size`
+def read_dicom(source, size=None, frame=0):
+    path = source if isinstance(source, (str, os.PathLike)) else None
+    # Deferred reads leave the pixel data element unread, with its file offset recorded
+    ds = _read_header(source, defer_size="1 KB")
+    frames = int(ds.get("NumberOfFrames", 1) or 1)
+    if not 0 <= frame < frames:
+        raise ValueError(f"Frame {frame} is out of range for a {frames}-frame file")
+    pixels = _mapped_frames(ds, path, source, frames)
+    if pixels is None:
+        # Compressed or colour data: decode everything through pydicom's handlers
+        ds = _read_header(source)
+        pixels = ds.pixel_array
+        if frames == 1:
+            pixels = pixels[None]
+        if pixels.ndim == 4:
+            pixels = pixels.mean(axis=3)
+    plane = window_level(
+        _subsample(pixels[frame], size),
+        _first(ds.get("WindowCenter")),
+        _first(ds.get("WindowWidth")),
+        float(ds.get("RescaleSlope", 1) or 1),
+        float(ds.get("RescaleIntercept", 0) or 0),
+        invert=ds.get("PhotometricInterpretation") == "MONOCHROME1"
+    )
+    return Image.fromarray(plane)
+
+
+# Window a 16-bit (or 32-bit) PIL image to a float32 "F" image, subsampled towards `size`
+def read_high_bit(image, size=None):
+    return Image.fromarray(window_level(_subsample(np.asarray(image), size)))
@@ -0,0 +1,161 @@
+# Per-stage latency histograms, exported as Prometheus text. Collection is off unless
+# BONESCAN_METRICS=1; when off, stage() returns one shared no-op context manager, so
+# instrumented code pays a single attribute check per stage. Set BONESCAN_METRICS_FILE
+# to have the text exposition written for a node_exporter textfile collector. trace()
+# also collects one request's stage timings, whether or not collection is on.
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+ENABLED = os.environ.get("BONESCAN_METRICS", "0") == "1"
+METRICS_FILE = os.environ.get("BONESCAN_METRICS_FILE", "")
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ("registry", "key", "trace", "start")
+
+    def __init__(self, registry, key, trace=None):
+        self.registry = registry
+        self.key = key
+        self.trace = trace
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        if self.registry.enabled:
+            self.registry.observe(self.key, seconds)
+        if self.trace is not None:
+            self.trace[self.key[0]] = self.trace.get(self.key[0], 0.0) + seconds
+        return False
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    # Quantile estimate by linear interpolation within the bucket that holds it
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    def __init__(self, enabled=ENABLED, buckets=BUCKETS, metrics_file=METRICS_FILE):
+        self.enabled = enabled
+        self.buckets = buckets
+        self.metrics_file = metrics_file
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._last_write = 0.0
+        self._local = threading.local()
+
+    # Time a block: `with metrics.stage("predict", model_name): ...`
+    def stage(self, stage, model="-"):
+        trace = getattr(self._local, "trace", None)
+        if not self.enabled and trace is None:
+            return _NULL_STAGE
+        return _Stage(self, (stage, model), trace)
+
+    # Collect the seconds spent in each stage run by this thread inside the block:
+    # `with metrics.trace() as timings: ...` leaves {stage: seconds} in `timings`
+    @contextmanager
+    def trace(self):
+        previous = getattr(self._local, "trace", None)
+        timings = self._local.trace = {}
+        try:
+            yield timings
+        finally:
+            self._local.trace = previous
+
+    def observe(self, key, seconds):
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return [
+                {
+                    "stage": stage,
+                    "model": model,
+                    "count": histogram.count,
+                    "mean_ms": round(histogram.sum / histogram.count * 1000, 1),
+                    "p50_ms": round(histogram.quantile(0.5) * 1000, 1),
+                    "p95_ms": round(histogram.quantile(0.95) * 1000, 1)
+                }
+                for (stage, model), histogram in sorted(self._histograms.items())
+            ]
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP bonescan_stage_seconds Latency of each analysis and prescription stage.",
+            "# TYPE bonescan_stage_seconds histogram"
+        ]
+        with self._lock:
+            for (stage, model), histogram in sorted(self._histograms.items()):
+                labels = f'stage="{stage}",model="{model}"'
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f'bonescan_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'bonescan_stage_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f"bonescan_stage_seconds_sum{{{labels}}} {histogram.sum:.6f}")
+                lines.append(f"bonescan_stage_seconds_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    # Atomically rewrite the metrics file, at most once per `min_interval` seconds
+    def export(self, min_interval=1.0):
+        if not self.enabled or not self.metrics_file:
+            return
+        now = time.time()
+        if now - self._last_write < min_interval:
+            return
+        self._last_write = now
+        tmp_path = f"{self.metrics_file}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, self.metrics_file)
+
+
+# Process-wide registry shared by every session
+metrics = MetricsRegistry()
@@ -0,0 +1,82 @@
+# Background model preloading and warmup, so the first analysis after a deploy
+# doesn't pay for download, deserialization and first-call graph tracing
+import itertools
+import queue
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+
+
+# Run one dummy batch at the model's input shape so its predict function is traced
+def warmup_model(model):
+    dummy = np.zeros((1,) + tuple(model.input_shape[1:]), dtype=np.float32)
+    model.predict_on_batch(dummy)
+
+
+class ModelPreloader:
+    URGENT = 0
+    BACKGROUND = 1
+
+    def __init__(self, registry):
+        self._registry = registry
+        self._queue = queue.PriorityQueue()
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._worker = threading.Thread(target=self._run, name="model-preloader", daemon=True)
+        self._worker.start()
+
+    # Queue a model for loading and warmup; urgent requests jump ahead of startup preloads
+    # and also bring back models that were skipped or have since been evicted
+    def prefetch(self, model_name, urgent=True):
+        with self._lock:
+            future = self._futures.get(model_name)
+            stale = future is not None and future.done() and (
+                future.exception() is not None or (urgent and not self._registry.is_resident(model_name))
+            )
+            if future is None or stale:
+                future = Future()
+                self._futures[model_name] = future
+            if not future.done():
+                priority = self.URGENT if urgent else self.BACKGROUND
+                self._queue.put((priority, next(self._seq), model_name))
+        return future
+
+    def preload(self, model_names):
+        for model_name in model_names:
+            self.prefetch(model_name, urgent=False)
+
+    # Block until the model has been loaded and warmed once
+    def wait(self, model_name):
+        self.prefetch(model_name).result()
+
+    def status(self, model_name):
+        future = self._futures.get(model_name)
+        if future is None:
+            return "not loaded"
+        if not future.done():
+            return "loading"
+        if future.exception() is not None:
+            return "failed"
+        return "ready" if self._registry.is_resident(model_name) else "not loaded"
+
+    def _run(self):
+        while True:
+            priority, _, model_name = self._queue.get()
+            with self._lock:
+                future = self._futures[model_name]
+            # Duplicate queue entries for a model that's already been handled
+            if future.done():
+                continue
+            # Startup preloads stop once the registry's memory budget is used up
+            if priority == self.BACKGROUND and not self._registry.has_headroom():
+                future.set_result(None)
+                continue
+            try:
+                with self._registry.acquire(model_name) as model:
+                    warmup_model(model)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(None)
@@ -0,0 +1,171 @@
+# Memory-bounded model registry: models are evicted least-recently-used first
+# once their measured footprint exceeds a byte budget, and reference counting
+# keeps a model resident while any predict is using it
+import gc
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+
+# Resident set size of this process in bytes, or None where /proc is unavailable
+def current_rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# Bytes held by a model's weights
+def weights_nbytes(model):
+    total = 0
+    for weight in getattr(model, "weights", []):
+        dtype = getattr(weight.dtype, "as_numpy_dtype", weight.dtype)
+        total += int(np.prod(tuple(weight.shape))) * np.dtype(dtype).itemsize
+    return total
+
+
+class _Entry:
+    __slots__ = ("model", "nbytes", "refs", "last_used")
+
+    def __init__(self, model, nbytes):
+        self.model = model
+        self.nbytes = nbytes
+        self.refs = 0
+        self.last_used = time.time()
+
+
+class ModelRegistry:
+    # `runtime`, if given, is called once before the first load is measured, so one-off
+    # framework start-up is not counted in that model's footprint
+    def __init__(self, loader, budget_bytes, runtime=None):
+        self._loader = loader
+        self._runtime = runtime
+        self.budget_bytes = budget_bytes
+        self._entries = OrderedDict()
+        self._known_sizes = {}
+        self._lock = threading.Lock()
+        # Loads are serialized so each RSS delta is attributable to one model
+        self._load_lock = threading.Lock()
+        self.loads = 0
+        self.hits = 0
+        self.evictions = 0
+
+    # Hold a model for the duration of the block; it cannot be evicted meanwhile
+    @contextmanager
+    def acquire(self, key):
+        entry = self._checkout(key)
+        try:
+            yield entry.model
+        finally:
+            self._release(key, entry)
+
+    def is_resident(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def has_headroom(self):
+        with self._lock:
+            return self._resident_bytes() < self.budget_bytes
+
+    # Whether these models fit the budget together, at the sizes measured when they were
+    # last loaded; models never loaded count as fitting
+    def fits(self, keys):
+        with self._lock:
+            return sum(self._known_sizes.get(key, 0) for key in set(keys)) <= self.budget_bytes
+
+    # Size measured at a model's last load, or None if it has not been loaded yet
+    def known_size(self, key):
+        with self._lock:
+            return self._known_sizes.get(key)
+
+    def _checkout(self, key):
+        with self._lock:
+            entry = self._take(key)
+        if entry is not None:
+            return entry
+        with self._load_lock:
+            with self._lock:
+                entry = self._take(key)
+                if entry is not None:
+                    return entry
+                # Make room up front when this model's size is known from an earlier load
+                evicted = self._evict_over_budget(self._known_sizes.get(key, 0))
+            if evicted:
+                gc.collect()
+            if self._runtime is not None:
+                self._runtime()
+                self._runtime = None
+            rss_before = current_rss()
+            model = self._loader(key)
+            rss_after = current_rss()
+            rss_delta = rss_after - rss_before if rss_before is not None and rss_after is not None else 0
+            entry = _Entry(model, max(weights_nbytes(model), rss_delta))
+            entry.refs = 1
+            with self._lock:
+                self._entries[key] = entry
+                self._known_sizes[key] = entry.nbytes
+                self.loads += 1
+                evicted = self._evict_over_budget()
+        if evicted:
+            gc.collect()
+        return entry
+
+    def _take(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.refs += 1
+            entry.last_used = time.time()
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return entry
+
+    def _release(self, key, entry):
+        with self._lock:
+            entry.refs -= 1
+            entry.last_used = time.time()
+            evicted = self._evict_over_budget()
+        if evicted:
+            gc.collect()
+
+    def _resident_bytes(self):
+        return sum(entry.nbytes for entry in self._entries.values())
+
+    # Drop idle models, least recently used first, until `incoming` more bytes fit the budget
+    def _evict_over_budget(self, incoming=0):
+        total = self._resident_bytes() + incoming
+        evicted = 0
+        for key, entry in list(self._entries.items()):
+            if total <= self.budget_bytes:
+                break
+            if entry.refs > 0:
+                continue
+            del self._entries[key]
+            total -= entry.nbytes
+            self.evictions += 1
+            evicted += 1
+        return evicted
+
+    def stats(self):
+        with self._lock:
+            now = time.time()
+            return {
+                "budget_bytes": self.budget_bytes,
+                "resident_bytes": self._resident_bytes(),
+                "loads": self.loads,
+                "hits": self.hits,
+                "evictions": self.evictions,
+                "models": [
+                    {
+                        "model": key,
+                        "bytes": entry.nbytes,
+                        "in_use": entry.refs,
+                        "idle_seconds": 0 if entry.refs else round(now - entry.last_used)
+                    }
+                    for key, entry in reversed(self._entries.items())
+                ]
+            }
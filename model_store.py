@@ -0,0 +1,208 @@
+# Verified model artifact store. Downloads go to a .part file, can resume after an
+# interruption, are checked against the manifest and only then renamed into place, so a
+# half-written .keras file is never mistaken for a model. Several files download in
+# parallel. BONESCAN_OFFLINE=1 restricts sources to BONESCAN_MODEL_MIRROR, a local
+# directory or a local HTTP stand-in, and never touches Google Drive.
+#   python model_store.py fetch      # download and verify every model
+#   python model_store.py verify     # check local files against the manifest
+#   python model_store.py record     # pin sha256/size of verified local files in the manifest
+import argparse
+import json
+import os
+import shutil
+import sys
+import threading
+import urllib.error
+import urllib.request
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from prediction_cache import file_checksum
+
+MODELS_DIR = "models"
+MANIFEST_PATH = os.environ.get("BONESCAN_MODEL_MANIFEST", os.path.join(MODELS_DIR, "manifest.json"))
+MIRROR = os.environ.get("BONESCAN_MODEL_MIRROR", "")
+OFFLINE = os.environ.get("BONESCAN_OFFLINE", "0") == "1"
+
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+_zip_checks = {}
+_zip_checks_lock = threading.Lock()
+
+
+class ArtifactError(Exception):
+    pass
+
+
+def load_manifest(path=MANIFEST_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write("\n")
+    os.replace(tmp_path, path)
+
+
+# CRC check of every member of a zip archive, memoized on (path, size, mtime) like
+# file_checksum, so a model is decompressed once per version rather than on every load
+def _zip_intact(path):
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _zip_checks_lock:
+        if memo_key in _zip_checks:
+            return _zip_checks[memo_key]
+    try:
+        with zipfile.ZipFile(path) as archive:
+            intact = archive.testzip() is None
+    except (zipfile.BadZipFile, OSError):
+        intact = False
+    with _zip_checks_lock:
+        _zip_checks[memo_key] = intact
+    return intact
+
+
+# Check a file against its manifest entry. Without a pinned checksum, the file must at
+# least be a complete zip archive (.keras files are zips), which catches truncation
+def verify_file(path, entry):
+    if not os.path.exists(path):
+        return False
+    if entry.get("size") is not None and os.path.getsize(path) != entry["size"]:
+        return False
+    if entry.get("sha256"):
+        return file_checksum(path) == entry["sha256"]
+    if path.endswith(".keras"):
+        return _zip_intact(path)
+    return True
+
+
+def _lock_for(path):
+    with _file_locks_guard:
+        return _file_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+# Append to an existing .part file from a local mirror file
+def _copy_resumable(source, part_path):
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if offset > os.path.getsize(source):
+        offset = 0
+    with open(source, "rb") as src, open(part_path, "ab" if offset else "wb") as dst:
+        src.seek(offset)
+        shutil.copyfileobj(src, dst, 1 << 20)
+
+
+# HTTP download that resumes a .part file with a Range request
+def _download_resumable(url, part_path):
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=60) as response:
+            # A server that ignores Range sends the whole file again
+            if offset and response.status != 206:
+                offset = 0
+            with open(part_path, "ab" if offset else "wb") as f:
+                shutil.copyfileobj(response, f, 1 << 20)
+    except urllib.error.HTTPError as e:
+        # 416: the .part file already holds the whole artifact
+        if e.code != 416:
+            raise
+
+
+def _fetch_to_part(file_name, entry, part_path, mirror, offline):
+    if mirror:
+        if mirror.startswith(("http://", "https://")):
+            _download_resumable(f"{mirror.rstrip('/')}/{file_name}", part_path)
+        else:
+            _copy_resumable(os.path.join(mirror, file_name), part_path)
+    elif offline:
+        raise ArtifactError(f"{file_name} is missing and offline mode has no BONESCAN_MODEL_MIRROR")
+    elif entry.get("url"):
+        _download_resumable(entry["url"], part_path)
+    else:
+        import gdown
+
+        gdown.download(f"https://drive.google.com/uc?id={entry['file_id']}", part_path, quiet=True, resume=True)
+
+
+# Make sure a verified copy of an artifact exists in MODELS_DIR and return its path
+def ensure_artifact(file_name, file_id=None, mirror=None, offline=None, manifest=None):
+    mirror = MIRROR if mirror is None else mirror
+    offline = OFFLINE if offline is None else offline
+    entry = dict((manifest if manifest is not None else load_manifest()).get(file_name, {}))
+    entry.setdefault("file_id", file_id)
+    path = os.path.join(MODELS_DIR, file_name)
+    os.makedirs(MODELS_DIR, exist_ok=True)
+    with _lock_for(path):
+        if verify_file(path, entry):
+            return path
+        part_path = f"{path}.part"
+        # One retry from scratch in case the resumed bytes were themselves bad
+        for attempt in range(2):
+            _fetch_to_part(file_name, entry, part_path, mirror, offline)
+            if verify_file(part_path, entry):
+                os.replace(part_path, path)
+                return path
+            os.remove(part_path)
+        raise ArtifactError(f"{file_name} failed verification against the manifest")
+
+
+def model_file_name(model_name):
+    return f"{model_name.replace(' ', '_')}.keras"
+
+
+# Fetch several models concurrently; returns {model name: path or exception}
+def ensure_models(model_names, workers=4, **kwargs):
+    from inference import model_ids
+
+    manifest = load_manifest()
+
+    def fetch(model_name):
+        try:
+            return ensure_artifact(model_file_name(model_name), model_ids[model_name], manifest=manifest, **kwargs)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(model_names)))) as executor:
+        return dict(zip(model_names, executor.map(fetch, model_names)))
+
+
+def main(argv=None):
+    from inference import model_ids
+
+    parser = argparse.ArgumentParser(description="Fetch, verify and pin model artifacts")
+    parser.add_argument("command", choices=["fetch", "verify", "record"])
+    parser.add_argument("--models", nargs="+", default=list(model_ids), choices=list(model_ids))
+    parser.add_argument("--mirror", default=None, help="local directory or HTTP base URL holding the .keras files")
+    parser.add_argument("--offline", action="store_true", default=None, help="use only the mirror")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    manifest = load_manifest()
+    failed = False
+    if args.command == "fetch":
+        for model_name, result in ensure_models(args.models, args.workers, mirror=args.mirror, offline=args.offline).items():
+            failed |= isinstance(result, Exception)
+            print(f"{model_name}: {result}")
+    else:
+        for model_name in args.models:
+            file_name = model_file_name(model_name)
+            path = os.path.join(MODELS_DIR, file_name)
+            entry = manifest.setdefault(file_name, {"file_id": model_ids[model_name]})
+            ok = verify_file(path, entry)
+            failed |= not ok
+            if args.command == "record" and ok:
+                entry.update(sha256=file_checksum(path), size=os.path.getsize(path))
+            print(f"{model_name}: {'ok' if ok else 'missing or invalid'}")
+        if args.command == "record":
+            save_manifest(manifest)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+# Perceptual-hash index of analysed films, so a re-upload that was rotated, re-compressed
+# or lightly cropped is recognised without running the model again. Each film gets a
+# 64-bit DCT pHash (the lookup key) and a 64-bit dHash (a second check against false
+# matches). Lookups use multi-index hashing: the pHash is split into four 16-bit chunks,
+# and any hash within distance r of the query matches at least one chunk within r // 4
+# bits, so a query probes a few hundred chunk values per table rather than scanning every
+# entry. The index persists as an append-only JSONL log, loaded once at startup and
+# extended as analyses complete
+import json
+import os
+import threading
+from itertools import combinations
+
+import numpy as np
+from PIL import Image
+
+from inference import display_image
+
+HASH_SIZE = 8
+DCT_SIZE = 32
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+MAX_DISTANCE = int(os.environ.get("BONESCAN_PHASH_MAX_DISTANCE", "8"))
+MAX_DHASH_DISTANCE = int(os.environ.get("BONESCAN_DHASH_MAX_DISTANCE", "16"))
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+
+_DCT = _dct_matrix(DCT_SIZE)
+
+
+def _bits_to_int(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def _phash(pixels):
+    coefficients = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE]
+    # The median leaves out the DC term, which only encodes overall brightness
+    return _bits_to_int(coefficients > np.median(coefficients.ravel()[1:]))
+
+
+def _dhash(pixels):
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+# [(pHash, dHash)] for the film in eight orientations (four rotations, each with and
+# without a horizontal flip); the first entry is the film as uploaded
+def perceptual_hashes(image):
+    image = display_image(image)
+    small = np.asarray(image.resize((DCT_SIZE, DCT_SIZE), Image.BILINEAR), dtype=np.float32)
+    tiny = np.asarray(image.resize((HASH_SIZE + 1, HASH_SIZE + 1), Image.BILINEAR), dtype=np.float32)
+    hashes = []
+    for flip in (False, True):
+        dct_pixels = small[:, ::-1] if flip else small
+        gradient_pixels = tiny[:, ::-1] if flip else tiny
+        for turns in range(4):
+            hashes.append((
+                _phash(np.rot90(dct_pixels, turns)),
+                _dhash(np.rot90(gradient_pixels, turns)[:HASH_SIZE])
+            ))
+    return hashes
+
+
+def _chunks(value):
+    return [(value >> (CHUNK_BITS * i)) & ((1 << CHUNK_BITS) - 1) for i in range(CHUNKS)]
+
+
+# XOR masks of every CHUNK_BITS-bit value within `radius` bits of zero
+def _probe_masks(radius):
+    return [0] + [
+        sum(1 << bit for bit in bits)
+        for distance in range(1, radius + 1)
+        for bits in combinations(range(CHUNK_BITS), distance)
+    ]
+
+
+class PerceptualIndex:
+    def __init__(self, path=None, max_distance=MAX_DISTANCE, max_dhash_distance=MAX_DHASH_DISTANCE):
+        self.path = path
+        self.max_distance = max_distance
+        self.max_dhash_distance = max_dhash_distance
+        self._phashes = []
+        self._dhashes = []
+        self._digests = []
+        self._results = []
+        self._by_digest = {}
+        self._tables = [{} for _ in range(CHUNKS)]
+        self._masks = _probe_masks(max_distance // CHUNKS)
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                        self._insert(row["digest"], int(row["phash"], 16), int(row["dhash"], 16),
+                                     row["model"], row["confidence"])
+                    except (ValueError, KeyError):
+                        # A torn last line from an interrupted write
+                        continue
+
+    def __len__(self):
+        return len(self._digests)
+
+    def _insert(self, digest, phash, dhash, model, confidence):
+        entry = self._by_digest.get(digest)
+        if entry is None:
+            entry = len(self._digests)
+            self._by_digest[digest] = entry
+            self._digests.append(digest)
+            self._phashes.append(phash)
+            self._dhashes.append(dhash)
+            self._results.append({})
+            for table, chunk in zip(self._tables, _chunks(phash)):
+                table.setdefault(chunk, []).append(entry)
+        self._results[entry][model] = confidence
+
+    # Record a model's result for a film (`hashes` as from perceptual_hashes)
+    def add(self, digest, hashes, model, confidence):
+        phash, dhash = hashes[0]
+        with self._lock:
+            entry = self._by_digest.get(digest)
+            if entry is not None and self._results[entry].get(model) == confidence:
+                return
+            self._insert(digest, phash, dhash, model, confidence)
+            if self.path:
+                with open(self.path, "a") as f:
+                    f.write(json.dumps({
+                        "digest": digest, "phash": f"{phash:016x}", "dhash": f"{dhash:016x}",
+                        "model": model, "confidence": confidence
+                    }) + "\n")
+
+    # Closest indexed film with a result for `model` in any orientation of the query, as
+    # {"digest", "distance", "confidence"}, or None when nothing is within max_distance
+    def lookup(self, hashes, model):
+        best = None
+        with self._lock:
+            for phash, dhash in hashes:
+                candidates = set()
+                for table, chunk in zip(self._tables, _chunks(phash)):
+                    for mask in self._masks:
+                        candidates.update(table.get(chunk ^ mask, ()))
+                for entry in candidates:
+                    if model not in self._results[entry]:
+                        continue
+                    distance = hamming(phash, self._phashes[entry])
+                    if distance > self.max_distance or hamming(dhash, self._dhashes[entry]) > self.max_dhash_distance:
+                        continue
+                    if best is None or distance < best["distance"]:
+                        best = {
+                            "digest": self._digests[entry],
+                            "distance": distance,
+                            "confidence": self._results[entry][model]
+                        }
+        return best
@@ -0,0 +1,146 @@
+# Content-addressed prediction cache: an in-memory LRU tier backed by an
+# optional size-bounded on-disk tier shared by every session and process
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+_checksums = {}
+_checksum_lock = threading.Lock()
+
+
+# SHA-256 of raw image bytes
+def image_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+# SHA-256 of a model file, memoized on (path, size, mtime) so it is hashed once per version
+def file_checksum(path):
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _checksum_lock:
+        if memo_key in _checksums:
+            return _checksums[memo_key]
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    with _checksum_lock:
+        _checksums[memo_key] = sha.hexdigest()
+    return _checksums[memo_key]
+
+
+class PredictionCache:
+    def __init__(self, max_entries=1024, cache_dir=None, max_disk_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir if cache_dir and max_disk_bytes > 0 else None
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, _, size in self._disk_entries())
+
+    # One key per (image, model, model file version)
+    @staticmethod
+    def make_key(image_hash, model_name, model_checksum):
+        return hashlib.sha256(f"{image_hash}:{model_name}:{model_checksum}".encode()).hexdigest()
+
+    # A None key (model version not yet known) never hits and is never stored
+    def get(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        value = self._read_disk(key)
+        if value is not None:
+            self._put_memory(key, value)
+        return value
+
+    def put(self, key, value):
+        if key is None:
+            return
+        self._put_memory(key, value)
+        self._write_disk(key, value)
+
+    def _put_memory(self, key, value):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path) as f:
+                value = json.load(f)
+            # Touch on read so disk eviction is least-recently-used, not oldest-written
+            os.utime(path)
+            return value
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key, value):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(value, f)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        with self._lock:
+            self._disk_bytes += size
+            over_budget = self._disk_bytes > self.max_disk_bytes
+        if over_budget:
+            self._evict_disk()
+
+    def _disk_entries(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, os.path.join(root, name), stat.st_size))
+        return entries
+
+    # Drop least-recently-used files until the tier is back under 90% of its budget
+    def _evict_disk(self):
+        entries = sorted(self._disk_entries())
+        total = sum(size for _, _, size in entries)
+        target = self.max_disk_bytes * 0.9
+        for _, path, size in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_bytes = total
+
+    def stats(self):
+        with self._lock:
+            return {
+                "memory_entries": len(self._memory),
+                "disk_bytes": self._disk_bytes if self.cache_dir else 0
+            }
@@ -0,0 +1,113 @@
+# Streamlit-free prescription PDF rendering, importable from worker processes
+from fpdf import FPDF
+from datetime import datetime
+from metrics import metrics
+
+# PDF Prescription Generator Class
+class PDF(FPDF):
+    def header(self):
+        self.set_font('Arial', 'B', 16)
+        self.cell(0, 10, 'MEDICAL PRESCRIPTION', 0, 1, 'C')
+        self.line(10, 20, 200, 20)
+        self.ln(10)
+        
+    def footer(self):
+        self.set_y(-15)
+        self.set_font('Arial', 'I', 8)
+        self.cell(0, 10, f'Page {self.page_no()}', 0, 0, 'C')
+
+def create_prescription(patient_info, diagnosis, medications, instructions, doctor_info, prescription_id=None):
+    pdf = PDF(orientation='P', unit='mm', format='A4')
+    pdf.add_page()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    
+    # Header with clinic info
+    pdf.set_font('Arial', 'B', 12)
+    pdf.cell(0, 5, "BoneScan AI Medical Center", 0, 1, 'C')
+    pdf.set_font('Arial', '', 10)
+    pdf.cell(0, 5, "123 Medical Drive, Healthcare City", 0, 1, 'C')
+    pdf.cell(0, 5, "Phone: (123) 456-7890 | License: MED123456", 0, 1, 'C')
+    pdf.ln(10)
+    
+    # Date and prescription ID
+    pdf.set_font('Arial', '', 10)
+    pdf.cell(0, 5, f"Date: {datetime.now().strftime('%d-%m-%Y %H:%M:%S')}", 0, 1, 'R')
+    if prescription_id is None:
+        prescription_id = f"RX-{datetime.now().strftime('%Y%m%d%H%M')}"
+    pdf.cell(0, 5, f"Prescription ID: {prescription_id}", 0, 1, 'R')
+    pdf.ln(5)
+    
+    # Patient information box
+    pdf.set_fill_color(240, 240, 240)
+    pdf.rect(10, 45, 190, 30, 'F')
+    pdf.set_font('Arial', 'B', 12)
+    pdf.set_xy(15, 50)
+    pdf.cell(0, 5, "PATIENT INFORMATION", 0, 1)
+    pdf.set_font('Arial', '', 10)
+    pdf.set_xy(15, 57)
+    pdf.cell(40, 5, f"Name: {patient_info['name']}", 0, 0)
+    pdf.cell(40, 5, f"Age: {patient_info['age']}", 0, 0)
+    pdf.cell(40, 5, f"Gender: {patient_info['gender']}", 0, 1)
+    pdf.set_xy(15, 64)
+    pdf.cell(40, 5, f"Patient ID: {patient_info['id']}", 0, 0)
+    pdf.cell(40, 5, f"Allergies: {patient_info['allergies']}", 0, 1)
+    pdf.ln(10)
+    
+    # Diagnosis
+    pdf.set_font('Arial', 'B', 12)
+    pdf.cell(0, 10, "DIAGNOSIS", 0, 1)
+    pdf.set_font('Arial', '', 11)
+    pdf.multi_cell(0, 7, diagnosis)
+    pdf.ln(10)
+    
+    # Medications
+    pdf.set_font('Arial', 'B', 12)
+    pdf.cell(0, 10, "PRESCRIBED MEDICATIONS", 0, 1)
+    pdf.set_font('Arial', '', 11)
+    
+    # Table header
+    pdf.set_fill_color(200, 200, 200)
+    pdf.cell(60, 8, "Medication", 1, 0, 'C', 1)
+    pdf.cell(30, 8, "Dosage", 1, 0, 'C', 1)
+    pdf.cell(30, 8, "Frequency", 1, 0, 'C', 1)
+    pdf.cell(30, 8, "Duration", 1, 0, 'C', 1)
+    pdf.cell(40, 8, "Instructions", 1, 1, 'C', 1)
+    
+    # Medication rows
+    pdf.set_fill_color(255, 255, 255)
+    for med in medications:
+        pdf.cell(60, 8, med['name'], 1)
+        pdf.cell(30, 8, med['dosage'], 1)
+        pdf.cell(30, 8, med['frequency'], 1)
+        pdf.cell(30, 8, med['duration'], 1)
+        pdf.cell(40, 8, med['special_instructions'], 1, 1)
+    pdf.ln(10)
+    
+    # Additional Instructions
+    pdf.set_font('Arial', 'B', 12)
+    pdf.cell(0, 10, "ADDITIONAL INSTRUCTIONS", 0, 1)
+    pdf.set_font('Arial', '', 11)
+    pdf.multi_cell(0, 7, instructions)
+    pdf.ln(15)
+    
+    # Doctor information
+    pdf.set_font('Arial', 'B', 12)
+    pdf.cell(0, 10, "PRESCRIBING PHYSICIAN", 0, 1)
+    pdf.set_font('Arial', '', 11)
+    pdf.cell(0, 7, f"Name: Dr. {doctor_info['name']}", 0, 1)
+    pdf.cell(0, 7, f"Specialty: {doctor_info['specialty']}", 0, 1)
+    pdf.cell(0, 7, f"License: {doctor_info['license']}", 0, 1)
+    pdf.cell(0, 7, f"Contact: {doctor_info['contact']}", 0, 1)
+    pdf.ln(10)
+    
+    # Signature line
+    pdf.line(120, pdf.get_y(), 180, pdf.get_y())
+    pdf.set_xy(120, pdf.get_y() + 2)
+    pdf.cell(60, 5, "Doctor's Signature", 0, 0, 'C')
+    
+    # Render to memory; fpdf 1.x returns a latin-1 string, fpdf2 a bytearray
+    with metrics.stage("prescription_output"):
+        pdf_bytes = pdf.output(dest='S')
+    if isinstance(pdf_bytes, str):
+        pdf_bytes = pdf_bytes.encode('latin-1')
+    return bytes(pdf_bytes)
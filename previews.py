@@ -0,0 +1,65 @@
+# Display previews. An uploaded film is decoded once, with JPEG draft downscaling, into
+# a display-width JPEG (or WebP) thumbnail cached by content hash, instead of being
+# re-encoded at full resolution as PNG on every rerun. Zoomed views decode and crop
+# full-resolution regions only when asked for
+import io
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from inference import decode_grayscale, display_image
+
+PREVIEW_WIDTH = int(os.environ.get("BONESCAN_PREVIEW_WIDTH", "800"))
+PREVIEW_FORMAT = os.environ.get("BONESCAN_PREVIEW_FORMAT", "JPEG").upper()
+PREVIEW_QUALITY = int(os.environ.get("BONESCAN_PREVIEW_QUALITY", "85"))
+
+
+# Encode a decoded film at no more than `width` pixels across
+def encode_preview(image, width=PREVIEW_WIDTH, image_format=PREVIEW_FORMAT, quality=PREVIEW_QUALITY):
+    image = display_image(image)
+    if image.width > width:
+        image = image.resize((width, max(1, round(image.height * width / image.width))), Image.BILINEAR)
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, quality=quality)
+    return buffer.getvalue()
+
+
+def make_thumbnail(source, width=PREVIEW_WIDTH, image_format=PREVIEW_FORMAT):
+    return encode_preview(decode_grayscale(source, (width, width), draft=True), width, image_format)
+
+
+# Region of the film around (center_x, center_y), given as fractions of its size, at `zoom`x
+# magnification. Only enough resolution for the region to fill `width` pixels is decoded
+def zoom_view(source, center_x, center_y, zoom, width=PREVIEW_WIDTH, image_format=PREVIEW_FORMAT):
+    image = decode_grayscale(source, (width * zoom, width * zoom), draft=True)
+    box_width, box_height = image.width / zoom, image.height / zoom
+    left = min(max(center_x * image.width - box_width / 2, 0), image.width - box_width)
+    top = min(max(center_y * image.height - box_height / 2, 0), image.height - box_height)
+    region = image.crop((round(left), round(top), round(left + box_width), round(top + box_height)))
+    return encode_preview(region, width, image_format)
+
+
+# Byte-bounded LRU of encoded previews, shared by every session
+class PreviewCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get_or_create(self, key, create):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        data = create()
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = data
+                self._bytes += len(data)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+        return data
@@ -0,0 +1,76 @@
+# Cold-start benchmark: import time and resident memory for each page, each measured in a
+# fresh interpreter so nothing is already cached in sys.modules.
+#   python startup_benchmark.py --repeats 5 [--model "MobileNet (Keras)"]
+import argparse
+import ast
+import json
+import statistics
+import subprocess
+import sys
+
+_CHILD = """
+import importlib, json, os, sys, time
+modules, model_name = json.loads(sys.argv[1])
+start = time.perf_counter()
+for module in modules:
+    importlib.import_module(module)
+import_seconds = time.perf_counter() - start
+load_seconds = None
+if model_name:
+    from inference import load_named_model
+    start = time.perf_counter()
+    load_named_model(model_name)
+    load_seconds = time.perf_counter() - start
+with open("/proc/self/statm") as f:
+    rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+print(json.dumps({"import_seconds": import_seconds, "load_seconds": load_seconds, "rss_bytes": rss}))
+"""
+
+
+# Modules app.py imports at top level, read from its source so the benchmark stays in sync
+def app_imports(path="app.py"):
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            modules.append(node.module)
+    return modules
+
+
+def measure(modules, model_name=None):
+    result = subprocess.run(
+        [sys.executable, "-c", _CHILD, json.dumps([modules, model_name])],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"Benchmark child failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure cold-start import time and RSS per page")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--model", help="also time loading this model on the detection page")
+    args = parser.parse_args(argv)
+
+    startup = app_imports()
+    pages = [
+        ("interpreter", [], None),
+        ("app startup / prescription page", startup, None),
+        ("fracture detection, first use", startup + ["tensorflow"], args.model),
+    ]
+    print(f"{'page':<34}{'import s':>10}{'load s':>10}{'RSS MB':>10}")
+    for page, modules, model_name in pages:
+        runs = [measure(modules, model_name) for _ in range(args.repeats)]
+        import_seconds = statistics.median(run["import_seconds"] for run in runs)
+        rss_mb = statistics.median(run["rss_bytes"] for run in runs) / 2**20
+        load = f"{statistics.median(run['load_seconds'] for run in runs):.2f}" if model_name else "-"
+        print(f"{page:<34}{import_seconds:>10.2f}{load:>10}{rss_mb:>10.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
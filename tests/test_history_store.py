@@ -0,0 +1,60 @@
+# Keyset pagination of the history store: pages follow each other without gaps or repeats,
+# and date-filtered pages stay index range scans with no sort of the whole date range
+from datetime import date, timedelta
+
+import pytest
+
+from history_store import HistoryStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    for i in range(95):
+        store.record_analysis(f"hash{i}", "MobileNet (Keras)/keras", "single", i / 100,
+                              {"predict": 0.01}, patient_id="P1" if i % 2 else "P2")
+    assert store.flush(timeout=10)
+    yield store
+    store.close()
+
+
+def all_pages(store, **kwargs):
+    ids, cursor = [], None
+    while True:
+        rows, cursor = store.page("analyses", before=cursor, limit=10, **kwargs)
+        ids.extend(row["id"] for row in rows)
+        if cursor is None:
+            return ids
+
+
+def test_pages_cover_every_row_once_newest_first(store):
+    ids = all_pages(store, filters={"patient_id": "P1"}, since=date.today(), until=date.today())
+    assert ids == sorted(ids, reverse=True)
+    assert len(ids) == len(set(ids)) == 47
+
+
+def test_date_bounds_outside_the_history(store):
+    assert store.page("analyses", since=date.today() + timedelta(days=1)) == ([], None)
+    assert store.page("analyses", until=date.today() - timedelta(days=1)) == ([], None)
+
+
+def test_date_filtered_page_needs_no_sort(store):
+    statements = []
+    conn = store._reader()
+    conn.set_trace_callback(statements.append)
+    store.page("analyses", filters={"patient_id": "P1"}, since=date.today(), until=date.today(), before=60)
+    conn.set_trace_callback(None)
+    page_query = next(sql for sql in statements if "ORDER BY id DESC" in sql)
+    plan = " ".join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {page_query}"))
+    assert "TEMP B-TREE" not in plan
+    assert "analyses_patient" in plan
+
+
+def test_identifiers_entered_later_update_the_recorded_row(store):
+    token = store.record_analysis("late", "MobileNet (Keras)/keras", "single", 0.9)
+    store.update_analysis(token, patient_id="P3")
+    store.update_analysis(token, patient_id="P3", doctor_license="L7")
+    assert store.flush(timeout=10)
+    rows, _ = store.page("analyses", filters={"patient_id": "P3"})
+    assert [(row["image_hash"], row["doctor_license"]) for row in rows] == [("late", "L7")]
+    assert len(all_pages(store)) == 96
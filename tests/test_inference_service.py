@@ -0,0 +1,52 @@
+# Inference service batching: concurrent first requests share one model load and warmup,
+# and /health answers from the event loop without hashing files on it
+import asyncio
+import io
+
+import numpy as np
+from PIL import Image
+
+from inference_service import InferenceService
+from model_registry import ModelRegistry
+
+
+class CountingModel:
+    input_shape = (None, 224, 224, 3)
+    weights = []
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def predict_on_batch(self, batch):
+        self.batch_sizes.append(len(batch))
+        return np.full((len(batch), 1), 0.8, dtype=np.float32)
+
+
+def film_png(size=512):
+    buffer = io.BytesIO()
+    Image.fromarray(np.random.default_rng(0).integers(0, 255, (size, size), dtype=np.uint8)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_concurrent_first_requests_share_one_load():
+    loaded = []
+
+    def load(key):
+        loaded.append(CountingModel())
+        return loaded[-1]
+
+    async def scenario():
+        service = InferenceService(ModelRegistry(load, budget_bytes=1 << 30), max_batch=16, max_wait_ms=50)
+        data = film_png()
+        key = ("MobileNet (Keras)", "keras")
+        results = await asyncio.gather(*(service.predict(data, key) for _ in range(16)))
+        health = await service.health()
+        return results, health
+
+    results, health = asyncio.run(scenario())
+    assert len(loaded) == 1
+    # One warmup batch, then the 16 requests in far fewer forward passes than requests
+    warmups, *batches = loaded[0].batch_sizes
+    assert warmups == 1 and sum(batches) == 16 and len(batches) < 16
+    assert all(result["confidence"] == np.float32(0.8) for result in results)
+    assert health["queues"][0]["requests"] == 16
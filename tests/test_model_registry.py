@@ -0,0 +1,28 @@
+# Model footprints are measured from after the framework runtime has started, so the
+# first model loaded is not charged for it
+import pytest
+
+from model_registry import ModelRegistry, current_rss
+
+RUNTIME_BYTES = 64 * 1024 * 1024
+runtime_memory = []
+
+
+class SmallModel:
+    weights = []
+
+
+def start_runtime():
+    runtime_memory.append(b"x" * RUNTIME_BYTES)
+
+
+@pytest.mark.skipif(current_rss() is None, reason="needs /proc/self/statm")
+def test_runtime_is_not_charged_to_the_first_model():
+    registry = ModelRegistry(lambda key: SmallModel(), budget_bytes=RUNTIME_BYTES, runtime=start_runtime)
+    with registry.acquire("first"):
+        pass
+    with registry.acquire("second"):
+        pass
+    assert len(runtime_memory) == 1
+    assert all(model["bytes"] < RUNTIME_BYTES // 4 for model in registry.stats()["models"])
+    assert registry.evictions == 0
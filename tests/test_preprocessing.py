@@ -0,0 +1,128 @@
+# Equivalence of the float32 preprocessing path with the original preprocess_image_tf.
+# Bit-exact for full decodes of grayscale films, which is what model inputs get by default;
+# with JPEG draft decoding opted in (BONESCAN_JPEG_DRAFT=1), the reduced DCT-scale decode
+# changes the resampling, so only a small tolerance is claimed
+import io
+from contextlib import contextmanager
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from ensemble import run_ensemble
+from inference import JPEG_DRAFT, decode_grayscale, preprocess_batch_tf, preprocess_image_tf
+
+# With draft decoding on, allowed difference in [0, 1] units: mean under 1 grey level, max under 4
+# (measured on 1200-3000 px films: mean under 0.5, max 3)
+DRAFT_MEAN_TOLERANCE = 1 / 255
+DRAFT_MAX_TOLERANCE = 4 / 255
+
+
+class FakeModel:
+    def __init__(self, size=224):
+        self.input_shape = (None, size, size, 3)
+
+
+# preprocess_image_tf as it was before the float32 rework, fed the way the app fed it
+def original_preprocess(source, model):
+    uploaded_image = Image.open(source).convert("RGB")
+    input_shape = model.input_shape[1:3]
+    img = uploaded_image.resize(input_shape).convert("L")
+    img_array = np.array(img) / 255.0
+    img_array = np.stack([img_array] * 3, axis=-1)
+    img_array = np.expand_dims(img_array, axis=0)
+    return img_array
+
+
+def synthetic_film(size=1200, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0.0, 1.0, size, dtype=np.float32)
+    bone = np.exp(-((x[None, :] - 0.5) ** 2) / 0.02) * 150 + 40 + 30 * x[:, None]
+    return np.clip(bone + rng.normal(0, 4, (size, size)), 0, 255).astype(np.uint8)
+
+
+def encode(pixels, image_format, mode="L"):
+    image = Image.fromarray(pixels)
+    if mode != "L":
+        image = image.convert(mode)
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, quality=92)
+    buffer.seek(0)
+    return buffer
+
+
+def new_preprocess(source, model, draft):
+    width, height = model.input_shape[2], model.input_shape[1]
+    return preprocess_image_tf(decode_grayscale(source, (width, height), draft=draft), model)
+
+
+@pytest.mark.parametrize("image_format,mode", [("PNG", "L"), ("PNG", "RGB"), ("JPEG", "L")])
+@pytest.mark.parametrize("size", [224, 299])
+def test_full_decode_is_bit_exact(image_format, mode, size):
+    model = FakeModel(size)
+    film = synthetic_film()
+    expected = original_preprocess(encode(film, image_format, mode), model)
+    actual = new_preprocess(encode(film, image_format, mode), model, draft=False)
+    assert actual.shape == expected.shape
+    assert actual.dtype == np.float32
+    # The model consumed the old float64 tensor as float32
+    assert np.array_equal(actual, expected.astype(np.float32))
+
+
+@pytest.mark.skipif(JPEG_DRAFT, reason="BONESCAN_JPEG_DRAFT=1 opts model inputs into draft decoding")
+@pytest.mark.parametrize("image_format", ["PNG", "JPEG"])
+def test_default_model_path_is_bit_exact(image_format):
+    model = FakeModel()
+    film = synthetic_film(2400)
+    expected = original_preprocess(encode(film, image_format), model).astype(np.float32)
+    actual = preprocess_image_tf(decode_grayscale(encode(film, image_format), (224, 224)), model)
+    assert np.array_equal(actual, expected)
+
+
+def test_batch_matches_single_image_path():
+    model = FakeModel()
+    films = [encode(synthetic_film(seed=seed), "PNG") for seed in range(3)]
+    for film in films:
+        # Same name, different content: rows are identified by position
+        film.name = "film.png"
+    batch, positions, errors = preprocess_batch_tf(films, model)
+    assert not errors and positions == [0, 1, 2]
+    for i in range(3):
+        films[i].seek(0)
+        expected = original_preprocess(films[i], model).astype(np.float32)[0]
+        assert np.array_equal(batch[i], expected)
+
+
+@pytest.mark.parametrize("size", [224, 299])
+def test_draft_decode_within_tolerance(size):
+    model = FakeModel(size)
+    film = synthetic_film(2400)
+    expected = original_preprocess(encode(film, "JPEG"), model).astype(np.float32)
+    actual = new_preprocess(encode(film, "JPEG"), model, draft=True)
+    difference = np.abs(actual - expected)
+    assert difference.mean() < DRAFT_MEAN_TOLERANCE
+    assert difference.max() < DRAFT_MAX_TOLERANCE
+
+
+class RecordingModel(FakeModel):
+    def predict_on_batch(self, batch):
+        self.batch = np.array(batch)
+        return np.zeros((len(batch), 1), dtype=np.float32)
+
+
+class FakeRegistry:
+    def __init__(self, models):
+        self.models = models
+
+    @contextmanager
+    def acquire(self, key):
+        yield self.models[key]
+
+
+def test_ensemble_members_see_the_single_model_tensor():
+    data = encode(synthetic_film(2400), "JPEG").getvalue()
+    models = {"small": RecordingModel(224), "large": RecordingModel(299)}
+    run_ensemble(lambda size: decode_grayscale(io.BytesIO(data), size), list(models), FakeRegistry(models))
+    for model in models.values():
+        expected = new_preprocess(io.BytesIO(data), model, draft=JPEG_DRAFT)
+        assert np.array_equal(model.batch, expected)
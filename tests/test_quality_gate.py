@@ -0,0 +1,78 @@
+# The quality gate on the draft decode: sharp films of any size pass, the same films
+# blurred by about one gate pixel are rejected as blurry, and a rejected study film can
+# still be analysed on request
+import io
+
+import pytest
+import streamlit as st
+from PIL import Image, ImageFilter
+from streamlit.testing.v1 import AppTest
+
+import inference
+import tflite_backend
+from quality_gate import _synthetic_film, assess_quality
+from test_rerun_isolation import StubModel, StubUpload
+
+
+def blurred(data, radius):
+    buffer = io.BytesIO()
+    Image.open(io.BytesIO(data)).filter(ImageFilter.GaussianBlur(radius)).save(buffer, format="JPEG", quality=92)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("size", [1024, 2048, 3000])
+@pytest.mark.parametrize("noise", [4, 12])
+def test_sharp_film_passes(size, noise):
+    report = assess_quality(io.BytesIO(_synthetic_film(size, noise=noise)))
+    assert report["passed"], report["issues"]
+
+
+@pytest.mark.parametrize("size", [1024, 3000])
+def test_blurred_film_is_rejected(size):
+    report = assess_quality(io.BytesIO(blurred(_synthetic_film(size), size / 256)))
+    assert not report["passed"]
+    assert any("blurry" in issue for issue in report["issues"])
+
+
+def test_small_film_is_rejected():
+    report = assess_quality(io.BytesIO(_synthetic_film(200)))
+    assert any("Resolution 200×200" in issue for issue in report["issues"])
+
+
+@pytest.fixture
+def batch_app(monkeypatch, tmp_path):
+    monkeypatch.setenv("BONESCAN_PRELOAD_MODELS", "")
+    monkeypatch.setenv("BONESCAN_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("BONESCAN_PHASH_INDEX", str(tmp_path / "phash.jsonl"))
+    monkeypatch.setenv("BONESCAN_HISTORY_DB", str(tmp_path / "history.db"))
+    monkeypatch.setattr(tflite_backend, "load_model_for_backend", lambda key: StubModel())
+    monkeypatch.setattr(inference, "start_tensorflow", lambda: None)
+    films = {"sharp.jpg": _synthetic_film(1024), "blurred.jpg": blurred(_synthetic_film(1024), 4)}
+
+    def uploads(*args, **kwargs):
+        files = []
+        for name, data in films.items():
+            upload = StubUpload(data)
+            upload.name, upload.file_id = name, name
+            files.append(upload)
+        return files if kwargs.get("accept_multiple_files") else files[0]
+
+    monkeypatch.setattr(st, "file_uploader", uploads)
+    st.cache_resource.clear()
+    at = AppTest.from_file("../app.py", default_timeout=60)
+    yield at
+    st.cache_resource.clear()
+
+
+def test_batch_film_can_be_analyzed_anyway(batch_app):
+    batch_app.run()
+    next(radio for radio in batch_app.sidebar.radio if "Analysis Mode" in radio.label).set_value("Batch Study").run()
+    assert not batch_app.exception
+    assert any("blurred.jpg did not pass" in warning.value for warning in batch_app.warning)
+    assert list(batch_app.dataframe[0].value["File"]) == ["sharp.jpg"]
+
+    next(box for box in batch_app.checkbox if box.label == "Analyze blurred.jpg anyway").check().run()
+    assert not batch_app.exception
+    assert list(batch_app.dataframe[0].value["File"]) == ["sharp.jpg", "blurred.jpg"]
+    # The override survives the rerun that analysed the film
+    assert next(box for box in batch_app.checkbox if box.label == "Analyze blurred.jpg anyway").value
@@ -0,0 +1,119 @@
+# Reruns from unrelated widgets must redraw the stored detection result, not re-run the
+# model or reload models. Drives app.py with Streamlit's AppTest: the uploader returns a
+# synthetic film and the model registry loads a stub that counts predict calls
+import io
+import sqlite3
+import time
+
+import numpy as np
+import pytest
+import streamlit as st
+from PIL import Image
+from streamlit.testing.v1 import AppTest
+
+import inference
+import tflite_backend
+
+predict_calls = []
+
+
+class StubModel:
+    input_shape = (None, 224, 224, 3)
+    weights = []
+
+    def predict(self, batch):
+        predict_calls.append(len(batch))
+        return np.full((len(batch), 1), 0.8, dtype=np.float32)
+
+    def predict_on_batch(self, batch):
+        return np.full((len(batch), 1), 0.8, dtype=np.float32)
+
+
+# Reports 100 MB of weights without allocating them
+class LargeStubModel(StubModel):
+    weights = [np.empty(25_000_000, dtype=np.float32)]
+
+
+class StubUpload(io.BytesIO):
+    name = "film.png"
+    file_id = "stub-film"
+
+    @property
+    def size(self):
+        return len(self.getvalue())
+
+
+def film_png(size=512):
+    rng = np.random.default_rng(0)
+    x = np.linspace(0.0, 1.0, size, dtype=np.float32)[None, :]
+    film = np.clip(np.exp(-((x - 0.5) ** 2) / 0.02) * 150 + 40 + rng.normal(0, 12, (size, size)), 0, 255)
+    buffer = io.BytesIO()
+    Image.fromarray(film.astype(np.uint8)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def app(monkeypatch, tmp_path):
+    monkeypatch.setenv("BONESCAN_PRELOAD_MODELS", "")
+    monkeypatch.setenv("BONESCAN_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("BONESCAN_PHASH_INDEX", str(tmp_path / "phash.jsonl"))
+    monkeypatch.setenv("BONESCAN_HISTORY_DB", str(tmp_path / "history.db"))
+    monkeypatch.setattr(tflite_backend, "load_model_for_backend", lambda key: StubModel())
+    monkeypatch.setattr(inference, "start_tensorflow", lambda: None)
+    data = film_png()
+    # AppTest cannot drive a file uploader, so every rerun gets a fresh handle on the same upload
+    monkeypatch.setattr(st, "file_uploader", lambda *args, **kwargs: StubUpload(data))
+    st.cache_resource.clear()
+    predict_calls.clear()
+    at = AppTest.from_file("../app.py", default_timeout=60)
+    yield at
+    st.cache_resource.clear()
+
+
+def test_theme_toggle_does_not_repeat_prediction(app):
+    app.run()
+    assert not app.exception
+    assert "Fracture" in "".join(element.value for element in app.markdown)
+    calls_after_upload = len(predict_calls)
+    assert calls_after_upload == 1
+
+    for _ in range(5):
+        theme_button = next(button for button in app.sidebar.button if "Mode" in button.label)
+        theme_button.click().run()
+        assert not app.exception
+    assert len(predict_calls) == calls_after_upload
+
+
+def test_reruns_do_not_reload_an_ensemble_over_budget(app, monkeypatch):
+    loads = []
+    monkeypatch.setenv("BONESCAN_MODEL_MEMORY_MB", "350")
+    monkeypatch.setattr(tflite_backend, "load_model_for_backend", lambda key: loads.append(key) or LargeStubModel())
+    app.run()
+    app.sidebar.selectbox[0].set_value("Ensemble").run()
+    assert not app.exception
+    time.sleep(0.5)
+    loads_after_analysis = len(loads)
+    assert loads_after_analysis >= 4
+
+    for _ in range(5):
+        theme_button = next(button for button in app.sidebar.button if "Mode" in button.label)
+        theme_button.click().run()
+        assert not app.exception
+    time.sleep(0.5)
+    assert len(loads) == loads_after_analysis
+    assert any("model memory budget" in warning.value for warning in app.warning)
+
+
+def test_patient_id_edits_update_one_history_row(app, tmp_path):
+    app.run()
+    for patient_id in ["P1", "P12", "P123"]:
+        app.text_input[0].input(patient_id).run()
+        assert not app.exception
+    deadline = time.monotonic() + 5
+    while True:
+        with sqlite3.connect(tmp_path / "history.db") as conn:
+            rows = conn.execute("SELECT patient_id FROM analyses").fetchall()
+        if rows == [("P123",)] or time.monotonic() > deadline:
+            break
+        time.sleep(0.1)
+    assert rows == [("P123",)]
@@ -0,0 +1,202 @@
+# TFLite CPU inference backend: float16 and int8 dynamic-range conversions of the
+# Keras models, cached next to the .keras files and run on the multithreaded
+# interpreter (XNNPACK is its default CPU delegate). TensorFlow is imported on first
+# conversion or interpreter load. Compare against Keras with:
+#   python tflite_backend.py --validation-dir data/validation --output tflite_report.json
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from batch_score import iter_image_paths, load_image
+from cpu_tuning import apply_tuned_config
+from inference import model_ids, model_path_for, load_named_model, model_input_size, predict_batch, start_tensorflow
+from model_registry import current_rss
+
+BACKENDS = ["keras", "tflite-float16", "tflite-int8"]
+TFLITE_THREADS = int(os.environ.get("BONESCAN_TFLITE_THREADS", str(os.cpu_count() or 1)))
+
+
+def tflite_path_for(model_name, backend):
+    return f"models/{model_name.replace(' ', '_')}.{backend.split('-', 1)[1]}.tflite"
+
+
+# File the given backend runs from, used to version cached predictions
+def artifact_path_for(model_name, backend):
+    if backend == "keras":
+        return model_path_for(model_name.replace(" ", "_"))
+    return tflite_path_for(model_name, backend)
+
+
+# Convert a model once; the artifact is rebuilt only when the .keras file is newer
+def convert_model(model_name, backend, keras_model=None):
+    keras_path = model_path_for(model_name.replace(" ", "_"))
+    path = tflite_path_for(model_name, backend)
+    if os.path.exists(path) and os.path.exists(keras_path) and os.path.getmtime(path) >= os.path.getmtime(keras_path):
+        return path
+    apply_tuned_config()
+    import tensorflow as tf
+
+    if keras_model is None:
+        keras_model = load_named_model(model_name)
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if backend == "tflite-float16":
+        converter.target_spec.supported_types = [tf.float16]
+    # Without a representative dataset, Optimize.DEFAULT gives int8 dynamic-range weights
+    flatbuffer = converter.convert()
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(flatbuffer)
+    os.replace(tmp_path, path)
+    return path
+
+
+# Keras-compatible wrapper around a TFLite interpreter
+class TFLiteModel:
+    def __init__(self, path, num_threads=TFLITE_THREADS):
+        # The TFLite path may be the first to import TensorFlow in this process
+        apply_tuned_config()
+        import tensorflow as tf
+
+        self.path = path
+        self._interpreter = tf.lite.Interpreter(model_path=path, num_threads=num_threads)
+        self._interpreter.allocate_tensors()
+        input_detail = self._interpreter.get_input_details()[0]
+        self._input_index = input_detail["index"]
+        self._output_index = self._interpreter.get_output_details()[0]["index"]
+        self._batch_size = int(input_detail["shape"][0])
+        self.input_shape = (None,) + tuple(int(d) for d in input_detail["shape"][1:])
+        # An interpreter holds mutable tensor state, so invocations are serialized
+        self._lock = threading.Lock()
+
+    def predict_on_batch(self, batch):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self._interpreter.resize_tensor_input(self._input_index, batch.shape)
+                self._interpreter.allocate_tensors()
+                self._batch_size = batch.shape[0]
+            self._interpreter.set_tensor(self._input_index, batch)
+            self._interpreter.invoke()
+            return self._interpreter.get_tensor(self._output_index).copy()
+
+    def predict(self, batch, batch_size=32, verbose=0):
+        return predict_batch(self, batch, batch_size)[:, None]
+
+
+# Registry loader for (model name, backend) keys
+def load_model_for_backend(key):
+    model_name, backend = key
+    if backend == "keras":
+        return load_named_model(model_name)
+    return TFLiteModel(convert_model(model_name, backend))
+
+
+# Per-model backend overrides, e.g. "MobileNet (Keras)=tflite-int8,DenseNet169 (Keras)=tflite-float16"
+def configured_backends(spec=None):
+    spec = os.environ.get("BONESCAN_MODEL_BACKENDS", "") if spec is None else spec
+    backends = {}
+    for item in spec.split(","):
+        if "=" in item:
+            model_name, backend = (part.strip() for part in item.split("=", 1))
+            if model_name in model_ids and backend in BACKENDS:
+                backends[model_name] = backend
+    return backends
+
+
+def _load_validation_batch(validation_dir, size, limit):
+    planes = []
+    for path in iter_image_paths(validation_dir):
+        _, plane, error = load_image(path, size)
+        if error is None:
+            planes.append(plane)
+        if limit and len(planes) >= limit:
+            break
+    batch = np.empty((len(planes), size[1], size[0], 3), dtype=np.float32)
+    for i, plane in enumerate(planes):
+        batch[i] = plane[:, :, None]
+    return batch
+
+
+def _latency_ms(model, batch, repeats):
+    timings = []
+    for i in range(repeats):
+        sample = batch[i % len(batch)][None]
+        start = time.perf_counter()
+        model.predict_on_batch(sample)
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings)), float(np.percentile(timings, 95))
+
+
+# Latency, memory and agreement with the Keras predictions for each backend of one model
+def compare_backends(model_name, validation_dir, batch_size=32, limit=500, repeats=50):
+    rows = []
+    # Measured from after TensorFlow's own start-up, as in the model registry
+    start_tensorflow()
+    rss_before = current_rss()
+    keras_model = load_named_model(model_name)
+    keras_rss = (current_rss() or 0) - (rss_before or 0)
+    batch = _load_validation_batch(validation_dir, model_input_size(keras_model), limit)
+    if not len(batch):
+        raise ValueError(f"No readable images in {validation_dir}")
+    models = {"keras": (keras_model, keras_rss)}
+    for backend in BACKENDS[1:]:
+        path = convert_model(model_name, backend, keras_model)
+        rss_before = current_rss()
+        models[backend] = (TFLiteModel(path), (current_rss() or 0) - (rss_before or 0))
+
+    reference = None
+    for backend, (model, rss_delta) in models.items():
+        model.predict_on_batch(batch[:1])
+        start = time.perf_counter()
+        scores = predict_batch(model, batch, batch_size)
+        throughput = len(batch) / (time.perf_counter() - start)
+        p50, p95 = _latency_ms(model, batch, repeats)
+        if reference is None:
+            reference = scores
+        rows.append({
+            "model": model_name,
+            "backend": backend,
+            "images": len(batch),
+            "latency_p50_ms": round(p50, 2),
+            "latency_p95_ms": round(p95, 2),
+            "throughput_per_s": round(throughput, 1),
+            "memory_mb": round(rss_delta / 2**20, 1),
+            "artifact_mb": round(os.path.getsize(artifact_path_for(model_name, backend)) / 2**20, 1),
+            "label_agreement": round(float(np.mean((scores > 0.5) == (reference > 0.5))), 4),
+            "max_abs_diff": round(float(np.max(np.abs(scores - reference))), 4)
+        })
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert models to TFLite and compare them with Keras")
+    parser.add_argument("--validation-dir", required=True, help="folder of validation X-rays")
+    parser.add_argument("--models", nargs="+", default=list(model_ids), choices=list(model_ids))
+    parser.add_argument("--limit", type=int, default=500, help="max validation images per model")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = []
+    for model_name in args.models:
+        report.extend(compare_backends(model_name, args.validation_dir, args.batch_size, args.limit))
+
+    columns = ["model", "backend", "latency_p50_ms", "latency_p95_ms", "throughput_per_s",
+               "memory_mb", "artifact_mb", "label_agreement", "max_abs_diff"]
+    print("\t".join(columns))
+    for row in report:
+        print("\t".join(str(row[column]) for column in columns))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+# Tiled sliding-window inference for high-resolution films. Squashing a 3000x3000 film to
+# the model's 224/299 input loses hairline fractures, so the full-resolution grayscale film
+# is cut into overlapping model-sized tiles instead. Tiles are converted into one reused
+# batch buffer, so memory stays bounded by batch_size tiles whatever the film size. Tile
+# scores become an image-level decision (the highest tile) and a coarse localisation grid,
+# and scoring stops early once any tile crosses the high-confidence threshold
+import os
+
+import numpy as np
+
+from inference import UNIT_SCALE, model_input_size
+
+# Films are downscaled to at most this many pixels on their long side before tiling
+MAX_SIDE = int(os.environ.get("BONESCAN_TILED_MAX_SIDE", "3072"))
+# Stop once a tile scores at least this (0 scores every tile)
+EARLY_EXIT = float(os.environ.get("BONESCAN_TILED_EARLY_EXIT", "0.95"))
+
+
+# Tile origins along one axis; the last tile is aligned to the far edge
+def tile_starts(length, tile, stride):
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile + 1, stride))
+    if starts[-1] != length - tile:
+        starts.append(length - tile)
+    return starts
+
+
+# Score a grayscale PIL image tile by tile. `stride` is in pixels (default half a tile).
+# Returns the image-level score, a (rows, cols) grid of tile scores (NaN where skipped
+# by the early exit) and how many tiles were scored
+def tiled_predict(model, image, stride=None, batch_size=32, early_exit=EARLY_EXIT, max_side=MAX_SIDE):
+    width, height = model_input_size(model)
+    if image.mode not in ("L", "F"):
+        image = image.convert("L")
+    if max_side and max(image.size) > max_side:
+        scale = max_side / max(image.size)
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))))
+    pixels = np.asarray(image)
+    # 8-bit films are scaled per tile through the lookup table; windowed "F" films already are
+    to_unit = (lambda tile: tile) if image.mode == "F" else UNIT_SCALE.__getitem__
+    # Films smaller than a tile are padded with black
+    pad_y, pad_x = max(height - pixels.shape[0], 0), max(width - pixels.shape[1], 0)
+    if pad_y or pad_x:
+        pixels = np.pad(pixels, ((0, pad_y), (0, pad_x)))
+
+    stride = max(1, stride or width // 2)
+    ys = tile_starts(pixels.shape[0], height, stride)
+    xs = tile_starts(pixels.shape[1], width, stride)
+    grid = np.full((len(ys), len(xs)), np.nan, dtype=np.float32)
+    positions = [(row, col, y, x) for row, y in enumerate(ys) for col, x in enumerate(xs)]
+    buffer = np.empty((min(batch_size, len(positions)), height, width, 3), dtype=np.float32)
+    scored = 0
+    for start in range(0, len(positions), batch_size):
+        chunk = positions[start:start + batch_size]
+        for i, (_, _, y, x) in enumerate(chunk):
+            buffer[i] = to_unit(pixels[y:y + height, x:x + width])[:, :, None]
+        scores = np.asarray(model.predict_on_batch(buffer[:len(chunk)]))[:, 0]
+        for (row, col, _, _), score in zip(chunk, scores):
+            grid[row, col] = score
+        scored += len(chunk)
+        if early_exit and float(scores.max()) >= early_exit:
+            break
+    return float(np.nanmax(grid)), grid, scored